@@ -1,25 +1,20 @@
 # agent_core.py
 # Premium Light version
-import subprocess, textwrap, json, os, re
-from agent_tools import handle_tool_call
+import textwrap, json, os, re
+from agent_tools import INCOMPLETE, JSON_OPEN, as_tool_calls, extract_tool_calls, handle_tool_call, json_at
+from gen_cache import get_cache
+from model_client import ANSI, DEFAULT_MODEL, clean, get_client
 
-ANSI = re.compile(r"\x1B\[[0-?]*[ -/]*[@-~]")
-
-def clean(text: str) -> str:
-    return ANSI.sub('', text or '')
-
-def ask_local_model(prompt: str, model: str = "qwen2.5") -> str:
-    cmd = ["ollama", "run", model]
-    try:
-        res = subprocess.run(cmd, input=prompt, text=True, capture_output=True, check=False)
-    except FileNotFoundError:
-        return "Local model runtime not found. Please install and start Ollama before chatting."
-
-    if res.returncode != 0:
-        details = clean(res.stderr) or "Unknown error"
-        return f"The local model could not be reached ({res.returncode}): {details}"
-
-    return clean(res.stdout)
+def ask_local_model(prompt: str, model: str = DEFAULT_MODEL) -> str:
+    cache = get_cache()
+    key = cache.key(model, prompt) if cache else None
+    hit = cache.get(key) if cache else None
+    if hit:
+        return hit.text
+    result = get_client().generate(prompt, model)
+    if cache:
+        cache.put(key, result)
+    return result.text
 
 def system_prompt() -> str:
     return """You are Dimi3 Personal AI running locally on his PC.
@@ -30,7 +25,123 @@ Roles:
 - Marketing engine
 Rules:
 - If normal question: answer normally.
-- If tool needed: respond ONLY in JSON {\"tool\":\"...\",\"args\":{...}}.
+- If tool needed: respond ONLY in JSON {\"tool\":\"...\",\"args\":{...}}, or a JSON list of such objects to run several independent tools at once.
 - You can browse the web, deep web, and .onion resources via the fetch_url tool for http/https URLs (including Tor-routed .onion hosts). Keep outputs concise and only fetch when it helps the user.
 - You may answer in any human language the user prefers and write code in any programming language without self-imposed restrictions.
 """
+
+def user_prompt(message: str, with_system: bool = True, history=None) -> str:
+    # Without the system block this is a continuation of an existing context.
+    # ``history`` is ``(summary, [(role, text), ...])`` from ConversationMemory.recall.
+    parts = [system_prompt()] if with_system else []
+    if history:
+        summary, turns = history
+        if summary:
+            parts.append("\nCONVERSATION SUMMARY:\n" + summary + "\n")
+        for role, text in turns:
+            parts.append("\n" + ("TOOL RESULT" if role == "tool" else role.upper()) + ":\n" + text)
+    parts.append("\nUSER:\n" + message + "\nASSISTANT:")
+    return "".join(parts)
+
+def _tool_results(results) -> str:
+    return "".join("Tool {name} returned:\n{result}\n\n".format(name=name, result=result) for name, result in results)
+
+def _next_step(final: bool) -> str:
+    if final:
+        return "Now respond to the user using the tool output above.\n"
+    return "Call more tools the same way if you still need them, otherwise respond to the user using the tool output above.\n"
+
+def tool_prompt(results, final: bool = True) -> str:
+    # Appended to the context that already holds the user message and the tool calls.
+    return "\n" + _tool_results(results) + _next_step(final)
+
+def follow_up_prompt(message: str, results, final: bool = True) -> str:
+    # Stand-alone variant for when the runtime gave us no context to continue from.
+    return """{base}
+USER:
+{user}
+ASSISTANT (tools executed):
+{results}{next}""".format(base=system_prompt(), user=message, results=_tool_results(results), next=_next_step(final))
+
+
+_FENCE = "```json"
+_PARTIAL = re.compile(r"[\[{]\s*\Z")  # a bracket whose first token has not arrived yet
+
+
+class ToolCallHold:
+    """Decides which streamed text can go to the user straight away.
+
+    Text is released as it arrives until a ``{`` or ``[`` (with a ```json
+    fence in front of it, if any) opens JSON that could still turn out to be
+    a tool call; from there it is held. JSON that completes without being a
+    call, or fails to parse, is released again, so the stream finds exactly
+    the calls :func:`extract_tool_calls` finds in the whole reply.
+    :meth:`finish` returns the held text and the tool calls found in it.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.released = 0
+        self.scan = 0         # where to look for the next opening bracket
+        self.pending = None   # bracket whose JSON is still incomplete
+        self.tried = 0        # length of that JSON at the last decode attempt
+        self.holding = False  # a complete tool call was seen; hold the rest
+        self.done = False     # nesting too deep to decode; nothing after can be a call
+
+    def feed(self, piece: str) -> str:
+        self.text += piece
+        start = self.released
+        if not self.holding:
+            self._advance()
+        return self.text[start:self.released]
+
+    def _advance(self) -> None:
+        text = self.text
+        while not self.done:
+            m = JSON_OPEN.search(text, self.scan)
+            if m is None:
+                break
+            i = m.start()
+            if i == self.pending and 256 < len(text) - i < self.tried * 5 // 4:
+                return  # re-decode long JSON only as it grows, so the cost stays linear
+            self.tried = len(text) - i
+            try:
+                value, end = json_at(text, i, final=False)
+            except RecursionError:
+                self.done = True
+                break
+            if value is INCOMPLETE:
+                self.pending, self.scan = i, i
+                self._release(i)
+                return
+            self.pending = None
+            if as_tool_calls(value):
+                self.holding = True
+                self._release(i)
+                return
+            self.scan = end
+        if self.done:
+            self.released = len(text)
+            return
+        m = _PARTIAL.search(text, max(self.scan, len(text) - 64))
+        self.scan = m.start() if m else len(text)
+        self._release(self.scan)
+
+    def _release(self, pos: int) -> None:
+        # Release up to ``pos`` but keep back a ```json fence in front of it,
+        # or at the very end anything that may still become one.
+        base = max(self.released, pos - 64)
+        head = self.text[base:pos].rstrip()
+        at_end = pos == len(self.text)
+        for k in range(len(_FENCE), 0, -1):
+            if head.endswith(_FENCE[:k]) and (at_end or k in (3, len(_FENCE))):
+                pos = base + len(head) - k
+                break
+        self.released = max(self.released, pos)
+
+    def finish(self, tools: bool = True):
+        held = self.text[self.released:]
+        calls = extract_tool_calls(held) if tools and held else []
+        rest = "" if calls else held
+        self.released = len(self.text)
+        return rest, calls
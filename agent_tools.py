@@ -1,10 +1,99 @@
 # agent_tools.py
-import json, os
-from pathlib import Path
-from typing import Any, Dict, Optional
+import asyncio, codecs, inspect, json, os, re, time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from file_tools import read_file
+from http_cache import ResponseCache
+from metrics import TOOL_RESULT_BYTES, TOOL_SECONDS
+
+ToolFunc = Callable[[Dict[str, Any]], Union[str, Awaitable[str]]]
+
+
+@dataclass
+class Tool:
+    name: str
+    func: ToolFunc
+    is_async: bool = False
+    timeout: float = 30.0
+    max_concurrency: int = 4
+    _limit: Optional[asyncio.Semaphore] = field(default=None, repr=False)
+
+    @property
+    def limit(self) -> asyncio.Semaphore:
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.max_concurrency)
+        return self._limit
+
+
+TOOLS: Dict[str, Tool] = {}
+
+
+def tool(name: str, timeout: float = 30.0, max_concurrency: int = 4):
+    """Register ``func(args) -> str`` as a tool. Coroutine functions run on the
+    event loop; plain functions run on a worker thread."""
+    def register(func: ToolFunc) -> ToolFunc:
+        TOOLS[name] = Tool(name, func, inspect.iscoroutinefunction(func), timeout, max_concurrency)
+        return func
+    return register
+
+
+_http: Optional[requests.Session] = None
+_cache: Any = False  # False = not opened yet, None = disabled
+
+
+def _http_session() -> requests.Session:
+    global _http
+    if _http is None:
+        _http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        _http.mount("http://", adapter)
+        _http.mount("https://", adapter)
+    return _http
+
+
+def _response_cache() -> Optional[ResponseCache]:
+    global _cache
+    if _cache is False:
+        _cache = ResponseCache.from_env()
+    return _cache
+
+
+def _body_length(headers) -> Optional[int]:
+    # Content-Length is the body size only without a content encoding; for
+    # gzip & co. it counts compressed bytes.
+    length = headers.get("Content-Length", "")
+    return int(length) if length.isdigit() and not headers.get("Content-Encoding") else None
+
+
+def _read_text(res: requests.Response, limit: int) -> Tuple[str, bool]:
+    """Decode the body until just past ``limit`` chars, then stop downloading."""
+    decoder = codecs.getincrementaldecoder(res.encoding or "utf-8")(errors="replace")
+    expected = _body_length(res.headers)  # tells us when we already have it all
+    parts, size, received = [], 0, 0
+    for chunk in res.iter_content(chunk_size=8192):
+        text = decoder.decode(chunk)
+        parts.append(text)
+        size += len(text)
+        received += len(chunk)
+        if size > limit and received != expected:
+            return "".join(parts), False
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts), True
+
+
+def _clip(body: str, limit: int, complete: bool, total: Optional[int]) -> str:
+    if complete and len(body) <= limit:
+        return body
+    if complete:
+        return body[:limit] + f"\n... (truncated, total {len(body)} chars)"
+    if total:
+        return body[:limit] + f"\n... (truncated, total {total} bytes)"
+    return body[:limit] + "\n... (truncated)"
 
 
 def _fetch_url(url: str, limit: int = 4000, use_tor: Optional[bool] = None, tor_proxy: Optional[str] = None) -> str:
@@ -17,34 +106,153 @@ def _fetch_url(url: str, limit: int = 4000, use_tor: Optional[bool] = None, tor_
     proxy = tor_proxy or os.getenv("TOR_PROXY", "socks5h://127.0.0.1:9050")
     proxies = {"http": proxy, "https": proxy} if should_use_tor else None
 
+    cache = _response_cache()
+    cached = cache.get(url) if cache else None
+    if cached and not cached.covers(limit):
+        cached = None
+    if cached and cached.fresh():
+        cache.hits += 1
+        return _clip(cached.body, limit, cached.complete, cached.total)
+
     try:
-        res = requests.get(url, timeout=15, proxies=proxies)
-        res.raise_for_status()
+        res = _http_session().get(
+            url,
+            timeout=15,
+            proxies=proxies,
+            stream=True,
+            headers=cached.validators() if cached else None,
+        )
+        with res:
+            if res.status_code == 304 and cached:
+                cache.revalidated += 1
+                cache.refresh(url, res.headers)
+                return _clip(cached.body, limit, cached.complete, cached.total)
+            res.raise_for_status()
+            body, complete = _read_text(res, limit)
     except Exception as exc:  # pragma: no cover - network dependent
         return f"Failed to fetch URL: {exc}"
 
-    body = res.text
-    if len(body) > limit:
-        return body[:limit] + f"\n... (truncated, total {len(body)} chars)"
-    return body
+    total = _body_length(res.headers)
+    if cache:
+        cache.misses += 1
+        cache.put(url, res.headers, body, complete, total)
+    return _clip(body, limit, complete, total)
+
+
+def fetch_stats() -> Dict[str, Any]:
+    cache = _response_cache()
+    return cache.stats() if cache else {}
+
+
+tool("read_file", timeout=10.0)(read_file)
+
+
+@tool("echo", timeout=1.0, max_concurrency=64)
+def _echo(args: Dict[str, Any]) -> str:
+    return args.get("text", "")
+
+
+@tool("fetch_url", timeout=20.0, max_concurrency=8)
+def _fetch_url_tool(args: Dict[str, Any]) -> str:
+    return _fetch_url(
+        str(args.get("url", "")),
+        limit=int(args.get("limit", 4000)),
+        use_tor=args.get("use_tor"),
+        tor_proxy=str(args.get("tor_proxy", "")) or None,
+    )
 
 
 def handle_tool_call(name: str, args: Dict[str, Any]):
-    try:
-        if name == "read_file":
-            p = Path(args.get("path", "")).expanduser()
-            if not p.exists():
-                return "File not found"
-            return p.read_text()
-        if name == "echo":
-            return args.get("text", "")
-        if name == "fetch_url":
-            return _fetch_url(
-                str(args.get("url", "")),
-                limit=int(args.get("limit", 4000)),
-                use_tor=args.get("use_tor"),
-                tor_proxy=str(args.get("tor_proxy", "")) or None,
-            )
+    t = TOOLS.get(name)
+    if t is None:
         return f"Unknown tool: {name}"
+    try:
+        if t.is_async:
+            return asyncio.run(asyncio.wait_for(t.func(args), t.timeout))
+        return t.func(args)
     except Exception as e:  # pragma: no cover - defensive guard
         return f"Tool error: {e}"
+
+
+async def run_tool(name: str, args: Dict[str, Any]) -> str:
+    """Run one tool under its concurrency limit and timeout; never raises."""
+    t = TOOLS.get(name)
+    if t is None:
+        return f"Unknown tool: {name}"
+    started, status = time.perf_counter(), "ok"
+    try:
+        async with t.limit:
+            call = t.func(args) if t.is_async else asyncio.to_thread(t.func, args)
+            result = await asyncio.wait_for(call, t.timeout)
+    except asyncio.TimeoutError:
+        status, result = "timeout", f"Tool {name} timed out after {t.timeout:g}s"
+    except Exception as e:
+        status, result = "error", f"Tool error: {e}"
+    TOOL_SECONDS.observe(time.perf_counter() - started, tool=name, status=status)
+    TOOL_RESULT_BYTES.observe(len(str(result).encode("utf-8")), tool=name)
+    return result
+
+
+async def run_tools(calls: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+    """Run the tool calls from one model reply concurrently, results in call order."""
+    return list(await asyncio.gather(*(run_tool(name, args) for name, args in calls)))
+
+
+_decoder = json.JSONDecoder()
+# A bracket that can open a JSON object/array; plain prose brackets are skipped
+# without a decode attempt (each failed decode costs O(offset) for its message).
+JSON_OPEN = re.compile(r'\{\s*["}]|\[\s*[-\d\[{"\]tfn]')
+INCOMPLETE = object()
+
+
+def json_at(text: str, start: int, final: bool = True) -> Tuple[Any, int]:
+    """Decode the JSON value opening at ``start``.
+
+    Returns ``(value, end)``, or ``(None, resume)`` on a syntax error, where
+    ``resume`` lies past the part that failed so a scan never re-reads it.
+    With ``final=False`` (text still streaming in) an error that more text
+    could fix gives ``(INCOMPLETE, start)``. Nesting deep enough to raise ``RecursionError`` is left to the caller;
+    it is never a tool call.
+    """
+    try:
+        return _decoder.raw_decode(text, start)
+    except json.JSONDecodeError as exc:
+        if not final and (exc.pos >= len(text) - 5 or exc.msg.startswith("Unterminated string")):
+            return INCOMPLETE, start
+        return None, max(start + 1, exc.pos)
+    except ValueError:  # e.g. an integer past the digit limit
+        return None, start + 1
+
+
+def as_tool_calls(obj: Any) -> List[Tuple[str, Dict[str, Any]]]:
+    if isinstance(obj, list):
+        return [call for item in obj for call in as_tool_calls(item)]
+    if not isinstance(obj, dict):
+        return []
+    if isinstance(obj.get("tool_calls"), list):
+        return as_tool_calls(obj["tool_calls"])
+    if obj.get("tool") and isinstance(obj["tool"], str):
+        args = obj.get("args", {})
+        return [(obj["tool"], args if isinstance(args, dict) else {})]
+    return []
+
+
+def extract_tool_calls(reply: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """Find ``{"tool": ..., "args": ...}`` calls in a model reply.
+
+    Accepts a single object, a list of them, or ``{"tool_calls": [...]}``,
+    also when wrapped in prose or a code fence.
+    """
+    if '"tool' not in reply:
+        return []
+    calls: List[Tuple[str, Dict[str, Any]]] = []
+    i = 0
+    while True:
+        m = JSON_OPEN.search(reply, i)
+        if m is None:
+            return calls
+        try:
+            obj, i = json_at(reply, m.start())
+        except RecursionError:
+            return calls
+        calls.extend(as_tool_calls(obj))
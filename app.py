@@ -1,49 +1,284 @@
 # app.py
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import json
+import asyncio, dataclasses, json, os
+from contextlib import aclosing
 
-from agent_core import ask_local_model, system_prompt
-from agent_tools import handle_tool_call
+from agent_core import ToolCallHold, follow_up_prompt, tool_prompt, user_prompt
+from agent_tools import extract_tool_calls, fetch_stats, run_tools
+from gen_cache import get_cache
+from memory import ConversationMemory, estimate_tokens
+from metrics import REGISTRY, REQUEST_SECONDS, STAGE_SECONDS
+from model_client import DEFAULT_MODEL, AsyncModelClient, get_client
+from scheduler import Overloaded, Scheduler
+from sessions import SessionStore
 import uvicorn
 
 app = FastAPI()
 app.mount('/static', StaticFiles(directory='static'), name='static')
 templates = Jinja2Templates(directory='templates')
 
+scheduler = Scheduler.from_env()
+model_client = AsyncModelClient(get_client())
+sessions = SessionStore.from_env()
+gen_cache = get_cache()
+MAX_TOOL_ROUNDS = int(os.getenv("DIMI_MAX_TOOL_ROUNDS", "3"))
+
+async def summarize(text: str, model: str, max_tokens: int) -> str:
+    result = await generate(text, scheduler.deadline(), model=model, options={"num_predict": max_tokens})
+    return result.text if result.ok else ""
+
+memory = ConversationMemory.from_env(summarize)
+
+def _scheduler_gauge(field: str):
+    return lambda: [("dimi_scheduler_" + field, {"model": m}, q[field]) for m, q in scheduler.stats().items()]
+
+def _event_counters():
+    for model, q in scheduler.stats().items():
+        for event in ("admitted", "rejected", "timed_out"):
+            yield "dimi_events_total", {"source": "scheduler", "event": event, "model": model}, q[event]
+    caches = {"generation_cache": gen_cache.stats() if gen_cache else {}, "http_cache": fetch_stats()}
+    for source, values in caches.items():
+        for event in ("hits", "misses", "coalesced", "revalidated", "evicted"):
+            if event in values:
+                yield "dimi_events_total", {"source": source, "event": event}, values[event]
+
+REGISTRY.collect("dimi_scheduler_active", "Generations running, per model.", "gauge", _scheduler_gauge("active"))
+REGISTRY.collect("dimi_scheduler_queued", "Generations waiting for a slot, per model.", "gauge", _scheduler_gauge("queued"))
+REGISTRY.collect("dimi_events_total", "Scheduler and cache event counters.", "counter", _event_counters)
+REGISTRY.collect("dimi_sessions", "Sessions held in memory.", "gauge",
+                 lambda: [("dimi_sessions", {}, len(sessions.sessions))])
+
+async def first_prompt(session, message: str) -> str:
+    # A live model context already holds the conversation; otherwise rebuild
+    # it from stored memory within the model's token budget.
+    if session.context is not None:
+        return user_prompt(message, with_system=False)
+    history = None
+    if memory and session.id:
+        history = await memory.history(session.id, reserve=estimate_tokens(message))
+    return user_prompt(message, history=history)
+
+async def remember(session, message: str, rounds: list, reply: str) -> None:
+    if memory and session.id:
+        tools = [("tool", "%s returned:\n%s" % (name, result)) for done in rounds for name, result in done]
+        # Summarise only history that will be read back: a session that keeps
+        # its model context does not recall memory until that context resets.
+        live = sessions.reuse and session.context is not None
+        await memory.remember(session.id, [("user", message)] + tools + [("assistant", reply)], compact=not live)
+
+def follow_up(session, message: str, results: list, rounds: list, final: bool) -> str:
+    # Continue the context from the previous call when we have it; otherwise
+    # fall back to re-sending the user message and every tool result so far.
+    if session.context:
+        return tool_prompt(results, final)
+    return follow_up_prompt(message, [r for done in rounds for r in done], final)
+
+def _remaining(deadline: float) -> float:
+    return max(0.0, deadline - asyncio.get_running_loop().time())
+
+async def _generate(prompt: str, deadline: float, context, model: str, options):
+    async with scheduler.slot(model, deadline):
+        return await asyncio.wait_for(
+            model_client.generate(prompt, model, options=options, context=context), _remaining(deadline))
+
+async def generate(prompt: str, deadline: float, context=None, model: str = DEFAULT_MODEL,
+                   options=None, cache: bool = True):
+    """One full completion, run under a scheduler slot and the request deadline.
+
+    Served from the generation cache when possible; identical requests in
+    flight share one generation. ``cache=False`` skips both, but the fresh
+    result still replaces the cached one.
+    """
+    produce = lambda: _generate(prompt, deadline, context, model, options)
+    if gen_cache is None:
+        return await produce()
+    key = gen_cache.key(model, prompt, options, context)
+    if not cache:
+        result = await produce()
+        gen_cache.put_later(key, result)
+        return result
+    return await gen_cache.aget(key) or await gen_cache.coalesce(key, produce)
+
+async def stream_model(prompt: str, deadline: float, context=None, model: str = DEFAULT_MODEL,
+                       options=None, cache: bool = True, slot=None):
+    """Like :func:`generate`, but yields chunks; the slot is held until the stream ends.
+
+    A cache hit comes back as a single final chunk. Streams are not coalesced.
+    ``slot`` is a :class:`Reservation` taken earlier, used instead of queueing.
+    """
+    key = gen_cache.key(model, prompt, options, context) if gen_cache else None
+    hit = await gen_cache.aget(key) if key and cache else None
+    if hit:
+        yield hit
+        return
+    text = []
+    async with slot or scheduler.slot(model, deadline):
+        async with aclosing(model_client.stream(prompt, model, options=options, context=context)) as chunks:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(anext(chunks), _remaining(deadline))
+                except StopAsyncIteration:
+                    return
+                text.append(chunk.text)
+                if key and chunk.done and chunk.ok:
+                    gen_cache.put_later(key, dataclasses.replace(chunk, text="".join(text)))
+                yield chunk
+
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, exc: Overloaded):
+    return JSONResponse(
+        {"error": str(exc)},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 @app.get('/', response_class=HTMLResponse)
 def home(request: Request):
     return templates.TemplateResponse('index.html', {'request': request})
 
+@app.get('/stats')
+async def stats():
+    return {"scheduler": scheduler.stats(), "sessions": sessions.stats(), "http_cache": fetch_stats(),
+            "generation_cache": gen_cache.stats() if gen_cache else {},
+            "memory": memory.stats() if memory else {}}
+
+@app.get('/metrics')
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.post('/chat')
-async def chat(payload: dict):
+async def chat(payload: dict, request: Request):
+    if payload.get('stream'):
+        return await _chat(payload, request)  # timed by chat_events
+    with REQUEST_SECONDS.time(mode="json"):
+        return await _chat(payload, request)
+
+async def _chat(payload: dict, request: Request):
     msg = payload.get('message','')
-    base_prompt = system_prompt()
-    initial_reply = ask_local_model(base_prompt + "\nUSER:\n" + msg + "\nASSISTANT:")
+    session = sessions.get(payload.get('session_id'))
+    params = {
+        "options": payload['options'] if isinstance(payload.get('options'), dict) else None,
+        "cache": payload.get('cache', True) is not False,
+    }
+    deadline = scheduler.deadline()
+    if payload.get('stream'):
+        # Admission (the first slot) happens before the response starts, so
+        # Overloaded still reaches the handler with a real status and Retry-After.
+        events = chat_events(msg, session, request, deadline, params)
+        await anext(events)
+        return StreamingResponse(events, media_type='application/x-ndjson')
 
-    reply = initial_reply
     try:
-        data = json.loads(initial_reply)
-        if isinstance(data, dict) and data.get("tool"):
-            tool_name = data.get("tool")
-            tool_args = data.get("args", {}) if isinstance(data.get("args", {}), dict) else {}
-            tool_result = handle_tool_call(tool_name, tool_args)
-
-            follow_up = """{base}
-USER:
-{user}
-ASSISTANT (tool executed):
-Tool {name} returned:\n{result}
-
-Now respond to the user using the tool output above.
-""".format(base=base_prompt, user=msg, name=tool_name, result=tool_result)
-            reply = ask_local_model(follow_up)
-    except json.JSONDecodeError:
-        pass
-
-    return {"reply": reply}
+        async with session.lock:
+            turn = sessions.begin_turn(session)
+            with STAGE_SECONDS.time(stage="prompt_build"):
+                prompt, rounds = await first_prompt(session, msg), []
+            while True:
+                result = await generate(prompt, deadline, session.context, **params)
+                sessions.record(session, result)
+                reply = result.text
+                with STAGE_SECONDS.time(stage="tool_parse"):
+                    calls = extract_tool_calls(reply) if len(rounds) < MAX_TOOL_ROUNDS else []
+                if not calls:
+                    break
+                results = list(zip((name for name, _ in calls), await run_tools(calls)))
+                rounds.append(results)
+                with STAGE_SECONDS.time(stage="prompt_build"):
+                    prompt = follow_up(session, msg, results, rounds, final=len(rounds) >= MAX_TOOL_ROUNDS)
+            usage = dict(sessions.end_turn(session, turn), tool_calls=sum(map(len, rounds)))
+            await remember(session, msg, rounds, reply)
+    except asyncio.TimeoutError:
+        return JSONResponse({"error": "The local model timed out."}, status_code=504)
+
+    return {"reply": reply, "usage": usage}
+
+
+class ClientGone(Exception):
+    """The streaming client disconnected mid-turn."""
+
+def _event(kind: str, **fields) -> bytes:
+    return (json.dumps(dict(type=kind, **fields)) + "\n").encode()
+
+async def chat_events(msg: str, session, request: Request, deadline: float, params: dict):
+    """NDJSON event stream for one chat turn.
+
+    Events: ``token`` (text delta), ``tool_start``/``tool_end``, ``done`` (full
+    reply and usage) and ``error``. JSON that may be a tool call is held back
+    until it is known not to be one; everything else is forwarded as the
+    model produces it. If the client goes away the turn is abandoned: the
+    upstream model request is closed, no further round starts, nothing is
+    remembered and the session keeps the context it had before the turn.
+    """
+    async def relay(prompt: str, hold: ToolCallHold, slot=None):
+        # Forward what the hold releases; anything that may be a tool call
+        # stays in ``hold`` until the reply is complete.
+        try:
+            async with aclosing(stream_model(prompt, deadline, session.context, slot=slot, **params)) as chunks:
+                async for chunk in chunks:
+                    if not chunk.ok:
+                        raise RuntimeError(chunk.text)
+                    if chunk.done:
+                        sessions.record(session, chunk)
+                    released = hold.feed(chunk.text) if chunk.text else ""
+                    if released:
+                        yield released
+                    if await request.is_disconnected():
+                        raise ClientGone()
+        finally:
+            if slot is not None:
+                slot.release()  # unused on a cache hit
+
+    # Timed from before the session lock, so lock and queue waits count and
+    # streams rejected at admission are recorded too.
+    with REQUEST_SECONDS.time(mode="stream"):
+        async with session.lock:
+            # The first yield only signals admission to _chat, which consumes it
+            # before the response starts; Overloaded from here reaches the handler.
+            reserved = await scheduler.reserve(DEFAULT_MODEL, deadline)
+            try:
+                yield b""
+                context, turn = session.context, sessions.begin_turn(session)
+                with STAGE_SECONDS.time(stage="prompt_build"):
+                    prompt, rounds, reply = await first_prompt(session, msg), [], ""
+                while True:
+                    hold = ToolCallHold()
+                    async for piece in relay(prompt, hold, reserved if not rounds else None):
+                        reply += piece
+                        yield _event("token", text=piece)
+
+                    with STAGE_SECONDS.time(stage="tool_parse"):
+                        rest, calls = hold.finish(tools=len(rounds) < MAX_TOOL_ROUNDS)
+                    if rest:
+                        reply += rest
+                        yield _event("token", text=rest)
+                    if not calls:
+                        break
+
+                    for name, args in calls:
+                        yield _event("tool_start", tool=name, args=args)
+                    results = list(zip((name for name, _ in calls), await run_tools(calls)))
+                    for name, result in results:
+                        yield _event("tool_end", tool=name, chars=len(str(result)))
+                    rounds.append(results)
+                    with STAGE_SECONDS.time(stage="prompt_build"):
+                        prompt = follow_up(session, msg, results, rounds, final=len(rounds) >= MAX_TOOL_ROUNDS)
+
+                usage = dict(sessions.end_turn(session, turn), tool_calls=sum(map(len, rounds)))
+                await remember(session, msg, rounds, reply)
+                yield _event("done", reply=reply, usage=usage)
+            except ClientGone:
+                # Abandon the turn: no more rounds, nothing remembered, and the
+                # session continues from where it was before this message.
+                session.context = context
+            except (RuntimeError, Overloaded) as exc:
+                yield _event("error", message=str(exc))
+            except asyncio.TimeoutError:
+                yield _event("error", message="The local model timed out.")
+            finally:
+                reserved.release()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,318 @@
+# bench.py
+# Latency benchmarks for the local model path.
+#
+#   python bench.py client            # real runtime: `ollama run` vs pooled HTTP client
+#   python bench.py client --stub     # same, against a stub server and a fake `ollama` CLI
+#   python bench.py sessions          # /chat turns with and without context reuse (stub runtime)
+#   python bench.py load              # /chat throughput and latency percentiles per concurrency level
+import argparse, json, os, statistics, sys, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+
+from model_client import DEFAULT_MODEL, ModelClient, run_cli
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(name: str, samples: List[float]) -> Dict[str, float]:
+    row = {
+        "name": name,
+        "n": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000 if samples else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+    print("{name:<12} n={n:<5} mean={mean_ms:8.2f}ms p50={p50_ms:8.2f}ms p95={p95_ms:8.2f}ms p99={p99_ms:8.2f}ms".format(**row))
+    return row
+
+
+class StubModelServer:
+    """Minimal stand-in for the runtime's ``/api/generate``.
+
+    Each call waits ``latency`` seconds plus prefill time for the new prompt
+    tokens at ``prefill_rate`` tokens/s, then emits ``tokens`` tokens at
+    ``token_rate`` tokens/s (0 = instantly). Tokens are estimated as chars/4;
+    a supplied ``context`` is treated as already evaluated, like the runtime's
+    prompt cache.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        tokens: int = 16,
+        token_rate: float = 0.0,
+        prefill_rate: float = 0.0,
+        host: str = "127.0.0.1",
+    ):
+        self.latency = latency
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.prefill_rate = prefill_rate
+        self.calls = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                req = json.loads(body or b"{}")
+                stub.calls += 1
+                stub.handle(self, req)
+
+        self.server = ThreadingHTTPServer((host, 0), Handler)
+        self.server.daemon_threads = True
+        self.server.handle_error = lambda request, address: None  # clients dropping idle connections
+        self.base_url = "http://%s:%d" % self.server.server_address
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def reply_tokens(self, req: dict) -> List[str]:
+        return ["tok%d " % i for i in range(self.tokens)]
+
+    def handle(self, h: BaseHTTPRequestHandler, req: dict) -> None:
+        prompt_tokens = len(req.get("prompt", "")) // 4
+        time.sleep(self.latency + (prompt_tokens / self.prefill_rate if self.prefill_rate else 0.0))
+        context = list(req.get("context") or []) + list(range(prompt_tokens + self.tokens))
+        tokens = self.reply_tokens(req)
+        gap = 1.0 / self.token_rate if self.token_rate else 0.0
+        final = {"done": True, "context": context, "prompt_eval_count": prompt_tokens, "eval_count": len(tokens)}
+
+        if not req.get("stream", True):
+            time.sleep(gap * len(tokens))
+            data = json.dumps(dict(final, response="".join(tokens))).encode()
+            h.send_response(200)
+            h.send_header("Content-Type", "application/json")
+            h.send_header("Content-Length", str(len(data)))
+            h.end_headers()
+            h.wfile.write(data)
+            return
+
+        h.send_response(200)
+        h.send_header("Content-Type", "application/x-ndjson")
+        h.send_header("Transfer-Encoding", "chunked")
+        h.end_headers()
+
+        def chunk(obj: dict) -> None:
+            line = json.dumps(obj).encode() + b"\n"
+            h.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            h.wfile.flush()
+
+        try:
+            for tok in tokens:
+                time.sleep(gap)
+                chunk({"response": tok, "done": False})
+            chunk(dict(final, response=""))
+            h.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def __enter__(self) -> "StubModelServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+FAKE_OLLAMA = """#!{python}
+import sys, time
+sys.stdin.read()
+time.sleep({latency})
+print(" ".join("tok%d" % i for i in range({tokens})))
+"""
+
+
+def fake_ollama_on_path(latency: float, tokens: int) -> str:
+    """Put a fake ``ollama`` executable first on PATH; returns its directory."""
+    d = tempfile.mkdtemp(prefix="fake-ollama-")
+    path = os.path.join(d, "ollama")
+    with open(path, "w") as f:
+        f.write(FAKE_OLLAMA.format(python=sys.executable, latency=latency, tokens=tokens))
+    os.chmod(path, 0o755)
+    os.environ["PATH"] = d + os.pathsep + os.environ.get("PATH", "")
+    return d
+
+
+def timed(fn: Callable[[], object], n: int, warmup: int = 2) -> List[float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def bench_client(args: argparse.Namespace) -> None:
+    prompt = args.prompt
+    if args.stub:
+        fake_ollama_on_path(args.latency, args.tokens)
+        with StubModelServer(latency=args.latency, tokens=args.tokens) as stub:
+            client = ModelClient(base_url=stub.base_url, fallback=False)
+            summarize("cli", timed(lambda: run_cli(prompt, args.model), args.n))
+            summarize("http", timed(lambda: client.generate(prompt, args.model), args.n))
+        return
+
+    client = ModelClient(fallback=False)
+    summarize("cli", timed(lambda: run_cli(prompt, args.model), args.n))
+    summarize("http", timed(lambda: client.generate(prompt, args.model, options={"num_predict": args.tokens}), args.n))
+
+
+def serve_app(port: int = 0):
+    """Run app.app with uvicorn on a background thread; returns (server, base_url).
+
+    The app's on-disk stores go to a throw-away directory, so benchmark
+    sessions and fetches never land in the user's real caches.
+    """
+    import socket
+    import uvicorn
+
+    scratch = tempfile.mkdtemp(prefix="dimi-bench-")
+    os.environ["DIMI_MEMORY_PATH"] = os.path.join(scratch, "memory.sqlite")
+    os.environ["DIMI_HTTP_CACHE"] = os.path.join(scratch, "http.sqlite")
+    os.environ.pop("DIMI_GEN_CACHE_PATH", None)
+
+    if not port:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config("app:app", host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, "http://127.0.0.1:%d" % port
+
+
+class ToolCallingStub(StubModelServer):
+    """Answers every user turn with a tool call, and tool results with text."""
+
+    def reply_tokens(self, req: dict) -> List[str]:
+        if req.get("prompt", "").rstrip().endswith("ASSISTANT:"):
+            return ['{"tool": "echo", "args": {"text": "%s"}}' % ("x" * 200)]
+        return super().reply_tokens(req)
+
+
+def bench_sessions(args: argparse.Namespace) -> None:
+    import requests
+
+    with ToolCallingStub(tokens=args.tokens, prefill_rate=args.prefill_rate) as stub:
+        os.environ["OLLAMA_HOST"] = stub.base_url
+        server, url = serve_app()
+        import app
+
+        http = requests.Session()
+        for reuse in (False, True):
+            app.sessions.reuse = reuse
+            session_id = "bench-%s-%s" % (reuse, time.time())
+            print("context reuse: %s" % ("on" if reuse else "off"))
+            for turn in range(1, args.turns + 1):
+                message = "question %d: %s" % (turn, "y" * args.message_chars)
+                # Without reuse the history is rebuilt from server-side memory each turn.
+                body = {"message": message, "session_id": session_id, "cache": False}
+                t0 = time.perf_counter()
+                res = http.post(url + "/chat", json=body).json()
+                elapsed = time.perf_counter() - t0
+                usage = res["usage"]
+                print("  turn %-3d calls=%d prompt_tokens=%-6d latency=%7.1fms" % (
+                    turn, usage["model_calls"], usage["prompt_tokens"], elapsed * 1000))
+        server.should_exit = True
+
+
+def bench_load(args: argparse.Namespace) -> None:
+    import concurrent.futures
+    import requests
+
+    os.environ.setdefault("DIMI_MAX_CONCURRENT", str(args.slots))
+    os.environ.setdefault("DIMI_MAX_QUEUE", str(args.queue))
+    stub_cls = ToolCallingStub if args.tools else StubModelServer
+    with stub_cls(latency=args.latency, tokens=args.tokens, token_rate=args.token_rate) as stub:
+        os.environ["OLLAMA_HOST"] = stub.base_url
+        server, url = serve_app()
+        counter = iter(range(1 << 62))
+        local = threading.local()
+
+        def one() -> Tuple[float, float, int]:
+            """Returns (latency, time to first token, status) for one /chat call."""
+            http = getattr(local, "http", None) or requests.Session()
+            local.http = http
+            body = {"message": "load %d" % next(counter), "stream": args.stream, "cache": False}
+            t0 = time.perf_counter()
+            ttft = 0.0
+            with http.post(url + "/chat", json=body, stream=args.stream) as res:
+                if args.stream and res.ok:
+                    for line in res.iter_lines():
+                        if not ttft and b'"token"' in line:
+                            ttft = time.perf_counter() - t0
+                else:
+                    res.content
+                return time.perf_counter() - t0, ttft, res.status_code
+
+        print("backend: latency=%gs tokens=%d token_rate=%g/s slots=%s queue=%s stream=%s tools=%s" % (
+            args.latency, args.tokens, args.token_rate, os.environ["DIMI_MAX_CONCURRENT"],
+            os.environ["DIMI_MAX_QUEUE"], args.stream, args.tools))
+        for level in args.concurrency:
+            with concurrent.futures.ThreadPoolExecutor(level) as pool:
+                list(pool.map(lambda _: one(), range(level)))  # warm connections
+                t0 = time.perf_counter()
+                results = list(pool.map(lambda _: one(), range(args.requests)))
+                wall = time.perf_counter() - t0
+            ok = [r for r in results if r[2] == 200]
+            print("concurrency=%-4d %6.1f req/s  errors=%d" % (level, len(ok) / wall, len(results) - len(ok)))
+            summarize("  latency", [r[0] for r in ok])
+            if args.stream:
+                summarize("  ttft", [r[1] for r in ok if r[1]])
+        server.should_exit = True
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Latency benchmarks for the local model path.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("client", help="per-call latency: `ollama run` subprocess vs pooled HTTP client")
+    p.add_argument("--n", type=int, default=50)
+    p.add_argument("--model", default=DEFAULT_MODEL)
+    p.add_argument("--prompt", default="Say hi.")
+    p.add_argument("--tokens", type=int, default=16)
+    p.add_argument("--stub", action="store_true", help="use a stub server and fake CLI instead of a real runtime")
+    p.add_argument("--latency", type=float, default=0.0, help="stub latency per call, seconds")
+    p.set_defaults(func=bench_client)
+
+    p = sub.add_parser("sessions", help="/chat prompt tokens and latency per turn, with and without context reuse")
+    p.add_argument("--turns", type=int, default=6)
+    p.add_argument("--tokens", type=int, default=32)
+    p.add_argument("--message-chars", type=int, default=200)
+    p.add_argument("--prefill-rate", type=float, default=20000.0, help="stub prefill speed, tokens/s")
+    p.set_defaults(func=bench_sessions)
+
+    p = sub.add_parser("load", help="/chat throughput and p50/p95/p99 against a fake model backend")
+    p.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 4, 16])
+    p.add_argument("--requests", type=int, default=100, help="requests per concurrency level")
+    p.add_argument("--latency", type=float, default=0.05, help="fake backend latency per call, seconds")
+    p.add_argument("--tokens", type=int, default=32)
+    p.add_argument("--token-rate", type=float, default=500.0, help="fake backend tokens/s (0 = instant)")
+    p.add_argument("--slots", type=int, default=4, help="DIMI_MAX_CONCURRENT for the run")
+    p.add_argument("--queue", type=int, default=64, help="DIMI_MAX_QUEUE for the run")
+    p.add_argument("--stream", action="store_true", help="use the NDJSON streaming mode")
+    p.add_argument("--tools", action="store_true", help="every turn makes one tool call")
+    p.set_defaults(func=bench_load)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# file_tools.py
+# Bounded file reads for the read_file tool: byte ranges, line ranges and
+# head/tail/grep scans that never pull a whole file into memory.
+import json, mmap, os, re, subprocess, sys
+from pathlib import Path
+from typing import Any, Dict
+
+DEFAULT_MAX_BYTES = 16 * 1024
+HARD_MAX_BYTES = 256 * 1024
+CHARS_PER_TOKEN = 4  # rough estimate, good enough for prompt budgeting
+DEFAULT_LINES = 50
+MAX_MATCHES = 200
+# A regex runs in a child process so a runaway pattern can be killed; re holds
+# the GIL while matching, and no thread-side timeout can stop it.
+REGEX_TIMEOUT = float(os.getenv("DIMI_GREP_REGEX_TIMEOUT", "5"))
+
+
+def _budget(args: Dict[str, Any]) -> int:
+    limit = min(int(args.get("max_bytes") or DEFAULT_MAX_BYTES), HARD_MAX_BYTES)
+    if args.get("max_tokens"):
+        limit = min(limit, int(args["max_tokens"]) * CHARS_PER_TOKEN)
+    return max(1, limit)
+
+
+def _decode(data: bytes) -> str:
+    # A cut may land inside a multi-byte character, so never fail on decoding.
+    return data.decode("utf-8", errors="replace")
+
+
+def _mapped(f) -> mmap.mmap:
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _read_range(path: Path, size: int, offset: int, length: int, budget: int) -> str:
+    # Negative values would turn f.read() into a whole-file read.
+    offset = max(0, min(offset, size))
+    want = max(0, min(length if length > 0 else budget, budget, size - offset))
+    with path.open("rb") as f:
+        f.seek(offset)
+        data = f.read(want)
+    text = _decode(data)
+    end = offset + len(data)
+    if offset == 0 and end == size:
+        return text
+    note = f"\n... (bytes {offset}-{end} of {size}"
+    if end < size:
+        note += f"; continue with offset={end}"
+    return text + note + ")"
+
+
+def _skip_line(f) -> bool:
+    # Bounded readline, so even a file with no newlines is never read whole.
+    while True:
+        chunk = f.readline(1 << 16)
+        if not chunk or chunk.endswith(b"\n"):
+            return bool(chunk)
+
+
+def _read_lines(path: Path, start: int, end: int, budget: int) -> str:
+    out, used, cut = [], 0, False
+    with path.open("rb") as f:
+        for _ in range(max(1, start) - 1):
+            if not _skip_line(f):
+                return ""
+        number = max(1, start)
+        while not end or number <= end:
+            line = f.readline(budget - used + 1)
+            if not line:
+                break
+            if used + len(line) > budget:
+                out.append(line[: budget - used])
+                cut = True
+                break
+            out.append(line)
+            used += len(line)
+            number += 1
+    text = _decode(b"".join(out))
+    return text + (f"\n... (truncated at {budget} bytes)" if cut else "")
+
+
+def _tail(path: Path, size: int, count: int, budget: int) -> str:
+    if size == 0:
+        return ""
+    with path.open("rb") as f, _mapped(f) as m:
+        start = size - 1 if m[size - 1] == ord("\n") else size  # ignore the final newline
+        for _ in range(count):
+            start = m.rfind(b"\n", 0, start)
+            if start < 0:
+                break
+        start += 1
+        if size - start > budget:
+            return "... (truncated)\n" + _decode(m[size - budget:size])
+        return _decode(m[start:size])
+
+
+def _grep(path: Path, size: int, pattern: str, ignore_case: bool, max_matches: int, budget: int,
+          regex: bool = False) -> str:
+    """Literal search by default; ``regex`` patterns run in a killable child."""
+    if size == 0:
+        return "No matches"
+    if not regex:
+        return _scan(path, size, re.escape(pattern), ignore_case, max_matches, budget)
+    job = json.dumps([str(path), size, pattern, ignore_case, max_matches, budget])
+    try:
+        res = subprocess.run(
+            [sys.executable, os.path.abspath(__file__)], input=job, capture_output=True,
+            text=True, encoding="utf-8", timeout=REGEX_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        return f"Regex search stopped after {REGEX_TIMEOUT:g}s; simplify the pattern or search literally"
+    if res.returncode != 0:
+        return "Regex search failed: " + (res.stderr.strip().splitlines() or ["unknown error"])[-1]
+    return res.stdout
+
+
+def _scan(path: Path, size: int, pattern: str, ignore_case: bool, max_matches: int, budget: int) -> str:
+    try:
+        regex = re.compile(pattern.encode("utf-8"), re.MULTILINE | (re.IGNORECASE if ignore_case else 0))
+    except re.error as exc:
+        return f"Invalid pattern: {exc}"
+    out, used = [], 0
+    line_no, counted_to, last_begin = 1, 0, -1
+    with path.open("rb") as f, _mapped(f) as m:
+        for match in regex.finditer(m):
+            begin = m.rfind(b"\n", 0, match.start()) + 1
+            if begin == last_begin:
+                continue  # another hit on a line we already reported
+            line_no += _count_newlines(m, counted_to, begin)
+            counted_to = last_begin = begin
+            end = m.find(b"\n", match.end())
+            end = size if end < 0 else end
+            line = b"%d: %s\n" % (line_no, m[begin:min(end, begin + 1000)])
+            if used + len(line) > budget:
+                out.append(b"... (truncated)\n")
+                break
+            out.append(line)
+            used += len(line)
+            if len(out) >= max_matches:
+                out.append(b"... (stopped after %d matches)\n" % max_matches)
+                break
+    return _decode(b"".join(out)) if out else "No matches"
+
+
+def _count_newlines(m: mmap.mmap, start: int, end: int, chunk: int = 1 << 20) -> int:
+    count = 0
+    while start < end:
+        stop = min(end, start + chunk)
+        count += m[start:stop].count(b"\n")
+        start = stop
+    return count
+
+
+def read_file(args: Dict[str, Any]) -> str:
+    """``read_file`` tool.
+
+    Without range arguments this returns the file if it fits the byte budget
+    (``max_bytes``, ``max_tokens``) and otherwise the first budget's worth.
+    ``offset``/``length`` select bytes, ``start_line``/``end_line`` lines, and
+    ``mode`` = ``head``/``tail``/``grep`` (with ``lines``, ``pattern``) scan
+    the file without loading it. ``pattern`` is literal unless ``regex`` is
+    set; regex searches run in a child process under a time limit.
+    """
+    p = Path(args.get("path", "")).expanduser()
+    if not p.exists():
+        return "File not found"
+    if not p.is_file():
+        return "Not a regular file"
+
+    size = p.stat().st_size
+    budget = _budget(args)
+    mode = str(args.get("mode") or "").lower()
+    count = int(args.get("lines") or DEFAULT_LINES)
+
+    if mode == "head":
+        return _read_lines(p, 1, count, budget)
+    if mode == "tail":
+        return _tail(p, size, count, budget)
+    if mode == "grep":
+        if not args.get("pattern"):
+            return "grep mode needs a pattern"
+        max_matches = min(int(args.get("max_matches") or MAX_MATCHES), MAX_MATCHES)
+        return _grep(p, size, str(args["pattern"]), bool(args.get("ignore_case")), max_matches, budget,
+                     regex=bool(args.get("regex")))
+    if mode:
+        return f"Unknown read_file mode: {mode}"
+    if args.get("start_line") or args.get("end_line"):
+        return _read_lines(p, int(args.get("start_line") or 1), int(args.get("end_line") or 0), budget)
+    return _read_range(p, size, int(args.get("offset") or 0), int(args.get("length") or budget), budget)
+
+
+if __name__ == "__main__":
+    # Child side of a regex grep (see _grep).
+    _path, _size, _pattern, _ignore_case, _max_matches, _budget = json.load(sys.stdin)
+    sys.stdout.reconfigure(encoding="utf-8")
+    sys.stdout.write(_scan(Path(_path), _size, _pattern, _ignore_case, _max_matches, _budget))
@@ -0,0 +1,272 @@
+# gen_cache.py
+# Exact-match cache and single-flight coalescing for model generations
+import asyncio, dataclasses, hashlib, json, os, sqlite3, threading, time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from model_client import Generation
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires REAL NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS generations_lru ON generations (last_access);
+CREATE INDEX IF NOT EXISTS generations_expires ON generations (expires);
+"""
+
+
+class GenerationCache:
+    """LRU of completed generations keyed on (model, prompt, options, context).
+
+    Bounded by entry count and total bytes, with a TTL. When ``path`` is set,
+    entries are also written to SQLite so they survive restarts; the memory
+    LRU stays the first stop; :meth:`aget` and :meth:`put_later` keep the
+    database off the event loop. The database is kept under ``max_db_bytes`` by
+    purging expired rows and evicting least recently used ones. Failed
+    generations are never stored.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttl: float = 3600.0,
+        path: Optional[str] = None,
+        max_db_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_db_bytes = max_db_bytes
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Tuple[float, int, Generation]]" = OrderedDict()
+        self.bytes = 0
+        self.inflight: Dict[str, List[Any]] = {}
+        self.hits = self.misses = self.coalesced = self.evicted = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self.db_bytes = 0
+        self._purged = 0.0
+        if path:
+            Path(path).expanduser().parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(Path(path).expanduser()), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            columns = [r[1] for r in self._db.execute("PRAGMA table_info(generations)")]
+            if columns and "last_access" not in columns:
+                self._db.execute("DROP TABLE generations")  # unbounded layout from before; it is only a cache
+            self._db.executescript(SCHEMA)
+            self._purge(time.time())
+
+    @classmethod
+    def from_env(cls) -> Optional["GenerationCache"]:
+        if os.getenv("DIMI_GEN_CACHE", "1") == "0":
+            return None
+        return cls(
+            max_entries=int(os.getenv("DIMI_GEN_CACHE_ENTRIES", "1024")),
+            max_bytes=int(float(os.getenv("DIMI_GEN_CACHE_MB", "32")) * 1024 * 1024),
+            ttl=float(os.getenv("DIMI_GEN_CACHE_TTL", "3600")),
+            path=os.getenv("DIMI_GEN_CACHE_PATH") or None,
+            max_db_bytes=int(float(os.getenv("DIMI_GEN_CACHE_DB_MB", "256")) * 1024 * 1024),
+        )
+
+    @staticmethod
+    def key(
+        model: str,
+        prompt: str,
+        options: Optional[Dict[str, Any]] = None,
+        context: Optional[List[int]] = None,
+    ) -> str:
+        h = hashlib.sha256()
+        h.update(json.dumps([model, options or {}], sort_keys=True).encode())
+        h.update(b"\0" + prompt.encode("utf-8") + b"\0")
+        if context:
+            h.update(",".join(map(str, context)).encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Generation]:
+        now = time.time()
+        result = self._recall(key, now)
+        if result is None:
+            result = self._load(key, now)
+        return self._counted(result)
+
+    async def aget(self, key: str) -> Optional[Generation]:
+        """:meth:`get` for the event loop; the database lookup runs on a worker thread."""
+        now = time.time()
+        result = self._recall(key, now)
+        if result is None and self._db is not None:
+            result = await asyncio.to_thread(self._load, key, now)
+        return self._counted(result)
+
+    def put(self, key: str, result: Generation) -> None:
+        row = self._stage(key, result)
+        if row is not None:
+            self._write(*row)
+
+    def put_later(self, key: str, result: Generation) -> None:
+        """:meth:`put` for the event loop: the memory LRU is updated now, the
+        database write is left to a worker thread."""
+        row = self._stage(key, result)
+        if row is not None:
+            asyncio.get_running_loop().run_in_executor(None, self._write, *row)
+
+    async def coalesce(self, key: str, produce: Callable[[], Awaitable[Generation]]) -> Generation:
+        """Run ``produce`` once for all concurrent callers with the same key.
+
+        The generation is cancelled only when every caller waiting on it has
+        gone away; a successful result is stored before anyone is woken.
+        """
+        entry = self.inflight.get(key)
+        leader = entry is None
+        if leader:
+            task = asyncio.ensure_future(produce())
+            entry = self.inflight[key] = [task, 0]
+            task.add_done_callback(lambda t: self._landed(key, t))
+        else:
+            self.coalesced += 1
+        entry[1] += 1
+        try:
+            result = await asyncio.shield(entry[0])
+            return dataclasses.replace(result) if leader else _served(result, "coalesced")
+        except asyncio.CancelledError:
+            entry[1] -= 1
+            if entry[1] == 0:
+                entry[0].cancel()
+            raise
+
+    def _landed(self, key: str, task: asyncio.Future) -> None:
+        self.inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.put_later(key, task.result())
+
+    def _recall(self, key: str, now: float) -> Optional[Generation]:
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, size, result = entry
+            if expires > now:
+                self.entries.move_to_end(key)
+                return _served(result)
+            del self.entries[key]
+            self.bytes -= size
+        return None
+
+    def _counted(self, result: Optional[Generation]) -> Optional[Generation]:
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def _stage(self, key: str, result: Generation) -> Optional[Tuple[str, str, float, int, float]]:
+        # Store in the memory LRU; returns the database row still to write, if any.
+        if not result.ok:
+            return None
+        value = json.dumps(dataclasses.asdict(result))
+        size = len(value)
+        if size > self.max_bytes:
+            return None
+        now = time.time()
+        self._remember(key, now + self.ttl, size, result)
+        if self._db is None or size > self.max_db_bytes:
+            return None
+        return key, value, now + self.ttl, size, now
+
+    def _write(self, key: str, value: str, expires: float, size: int, now: float) -> None:
+        with self._lock:
+            old = self._db.execute("SELECT size FROM generations WHERE key = ?", (key,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?, ?)", (key, value, expires, size, now))
+            self.db_bytes += size - (old[0] if old else 0)
+            if now - self._purged > min(self.ttl, 600.0):
+                self._purge(now)
+            self._evict()
+
+    def _remember(self, key: str, expires: float, size: int, result: Generation) -> None:
+        with self._lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (expires, size, result)
+            self.bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                _, (_, dropped, _) = self.entries.popitem(last=False)
+                self.bytes -= dropped
+                self.evicted += 1
+
+    def _load(self, key: str, now: float) -> Optional[Generation]:
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT value, expires, size FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._db.execute("DELETE FROM generations WHERE key = ?", (key,))
+                self.db_bytes -= row[2]
+                return None
+            self._db.execute("UPDATE generations SET last_access = ? WHERE key = ?", (now, key))
+        result = Generation(**json.loads(row[0]))
+        self._remember(key, row[1], len(row[0]), result)
+        return _served(result)
+
+    def _purge(self, now: float) -> None:
+        # Caller holds the lock (or is the constructor).
+        self._purged = now
+        expired = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM generations WHERE expires <= ?", (now,)).fetchone()[0]
+        if expired:
+            self._db.execute("DELETE FROM generations WHERE expires <= ?", (now,))
+        self.db_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+
+    def _evict(self) -> None:
+        # Caller holds the lock. Expired rows go first, then least recently used.
+        if self.db_bytes <= self.max_db_bytes:
+            return
+        self._purge(time.time())
+        while self.db_bytes > self.max_db_bytes:
+            rows = self._db.execute("SELECT key, size FROM generations ORDER BY last_access LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._db.execute("DELETE FROM generations WHERE key = ?", (key,))
+                self.db_bytes -= size
+                self.evicted += 1
+                if self.db_bytes <= self.max_db_bytes:
+                    break
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self.inflight),
+            "evicted": self.evicted,
+            "db_bytes": self.db_bytes,
+        }
+
+
+def _served(result: Generation, source: str = "cache") -> Generation:
+    # Nothing was evaluated for this caller; report it that way in session usage.
+    return dataclasses.replace(result, source=source, prompt_eval_count=0, eval_count=0)
+
+
+_default_cache: Any = False  # False = not created yet, None = disabled
+_default_lock = threading.Lock()
+
+
+def get_cache() -> Optional[GenerationCache]:
+    global _default_cache
+    if _default_cache is False:
+        with _default_lock:
+            if _default_cache is False:
+                _default_cache = GenerationCache.from_env()
+    return _default_cache
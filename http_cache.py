@@ -0,0 +1,177 @@
+# http_cache.py
+# Small on-disk HTTP response cache for fetch_url (SQLite, size-bounded LRU)
+import os, re, sqlite3, threading, time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional
+
+HEURISTIC_MAX = 24 * 3600  # cap for Last-Modified based freshness, seconds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    complete INTEGER NOT NULL,
+    total INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    expires REAL NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access);
+"""
+
+
+@dataclass
+class CachedResponse:
+    url: str
+    body: str
+    complete: bool
+    total: Optional[int]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    expires: float
+
+    def fresh(self, now: Optional[float] = None) -> bool:
+        return self.expires > (now if now is not None else time.time())
+
+    def covers(self, limit: int) -> bool:
+        """Whether the stored text can answer a request for ``limit`` chars."""
+        return self.complete or len(self.body) > limit
+
+    def validators(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def freshness(headers: Mapping[str, str], now: Optional[float] = None) -> Optional[float]:
+    """Seconds a response may be served without revalidation, or ``None`` if it
+    must not be stored at all (``no-store``)."""
+    now = now if now is not None else time.time()
+    cc = (headers.get("Cache-Control") or "").lower()
+    if "no-store" in cc:
+        return None
+    if "no-cache" in cc:
+        return 0.0
+    # s-maxage is for shared caches only; this one is private to the client.
+    m = re.search(r"(?<![-\w])max-age\s*=\s*\"?(\d+)", cc)
+    if m:
+        return max(0.0, float(m.group(1)) - float(headers.get("Age") or 0))
+    date = _http_date(headers.get("Date")) or now
+    expires = headers.get("Expires")
+    if expires is not None:
+        at = _http_date(expires)
+        return max(0.0, at - date) if at else 0.0
+    modified = _http_date(headers.get("Last-Modified"))
+    if modified and modified < date:
+        return min(HEURISTIC_MAX, 0.1 * (date - modified))
+    return 0.0
+
+
+class ResponseCache:
+    """URL -> decoded body, honouring ETag/Last-Modified/Cache-Control.
+
+    Entries past their freshness lifetime stay on disk while they carry a
+    validator, so a later fetch can turn into a cheap conditional request.
+    The database is kept under ``max_bytes`` by evicting least recently used
+    entries.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.revalidated = 0
+        Path(path).expanduser().parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(Path(path).expanduser()), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        path = os.getenv("DIMI_HTTP_CACHE", str(Path.home() / ".cache" / "dimi-ai" / "http.sqlite"))
+        if not path or path == "0":
+            return None
+        return cls(path, max_bytes=int(float(os.getenv("DIMI_HTTP_CACHE_MB", "64")) * 1024 * 1024))
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, body, complete, total, etag, last_modified, expires FROM responses WHERE url = ?",
+                (url,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE responses SET last_access = ? WHERE url = ?", (time.time(), url))
+        return CachedResponse(row[0], row[1], bool(row[2]), row[3], row[4], row[5], row[6])
+
+    def put(
+        self,
+        url: str,
+        headers: Mapping[str, str],
+        body: str,
+        complete: bool,
+        total: Optional[int] = None,
+    ) -> None:
+        lifetime = freshness(headers)
+        etag, modified = headers.get("ETag"), headers.get("Last-Modified")
+        if lifetime is None or (lifetime <= 0 and not (etag or modified)):
+            return  # nothing we could ever serve or revalidate
+        size = len(body.encode("utf-8")) + len(url)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, body, int(complete), total, etag, modified, now + lifetime, size, now),
+            )
+            self._evict()
+
+    def refresh(self, url: str, headers: Mapping[str, str]) -> None:
+        """Apply the headers of a ``304 Not Modified`` to the stored entry."""
+        lifetime = freshness(headers) or 0.0
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE responses SET expires = ?, last_access = ?,"
+                " etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) WHERE url = ?",
+                (now + lifetime, now, headers.get("ETag"), headers.get("Last-Modified"), url),
+            )
+
+    def _evict(self) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, size in self._db.execute("SELECT url, size FROM responses ORDER BY last_access").fetchall():
+            self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+        }
@@ -0,0 +1,300 @@
+# memory.py
+# Server-side conversation memory: recent turns verbatim, older turns and
+# oversized tool outputs folded into a running summary, all kept in SQLite.
+import asyncio, os, sqlite3, threading, time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from model_client import DEFAULT_MODEL
+
+CHARS_PER_TOKEN = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    session TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    text TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    PRIMARY KEY (session, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS summaries (
+    session TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    upto INTEGER NOT NULL,
+    pending INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS summaries_updated ON summaries (updated);
+"""
+
+Summarizer = Callable[[str, str, int], Awaitable[str]]  # (instructions + text, model, max_tokens) -> summary
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+CLIPPED = "\n... (clipped) ...\n"
+
+
+def _clip(text: str, tokens: int) -> str:
+    chars = tokens * CHARS_PER_TOKEN
+    if len(text) <= chars:
+        return text
+    keep = max(0, chars - len(CLIPPED))  # the marker counts against the budget too
+    head = keep * 3 // 4
+    return text[:head] + CLIPPED + text[len(text) - (keep - head):]
+
+
+def parse_budgets(spec: str) -> Dict[str, int]:
+    """``"qwen2.5=4096,llama3=8192"`` -> per-model token budgets."""
+    budgets = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, tokens = item.rpartition("=")
+        if model and tokens.isdigit():
+            budgets[model] = int(tokens)
+    return budgets
+
+
+class ConversationMemory:
+    """Per-session history under a per-model token budget.
+
+    :meth:`recall` walks turns newest first and stops at the budget, so
+    building a prompt costs what is sent, not the whole history. When
+    :meth:`remember` pushes a session over budget it schedules :meth:`compact`
+    in the background; it asks ``summarize`` to fold the oldest turns into the
+    session's running summary and to shrink oversized tool outputs, then
+    deletes the folded rows. Nothing but the SQLite connection is held in
+    memory between requests.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        summarize: Optional[Summarizer] = None,
+        budget: int = 2048,
+        budgets: Optional[Dict[str, int]] = None,
+        tool_tokens: int = 512,
+        ttl: float = 30 * 24 * 3600.0,
+    ):
+        self.summarize = summarize
+        self.budget = budget
+        self.budgets = budgets or {}
+        self.tool_tokens = tool_tokens
+        self.ttl = ttl
+        self.compactions = 0
+        self.appends = 0
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        Path(path).expanduser().parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(Path(path).expanduser()), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls, summarize: Optional[Summarizer] = None) -> Optional["ConversationMemory"]:
+        path = os.getenv("DIMI_MEMORY_PATH", str(Path.home() / ".cache" / "dimi-ai" / "memory.sqlite"))
+        if not path or path == "0":
+            return None
+        return cls(
+            path,
+            summarize=summarize,
+            budget=int(os.getenv("DIMI_MEMORY_TOKENS", "2048")),
+            budgets=parse_budgets(os.getenv("DIMI_MEMORY_BUDGETS", "")),
+            tool_tokens=int(os.getenv("DIMI_MEMORY_TOOL_TOKENS", "512")),
+            ttl=float(os.getenv("DIMI_MEMORY_TTL_DAYS", "30")) * 24 * 3600,
+        )
+
+    def budget_for(self, model: str) -> int:
+        return self.budgets.get(model, self.budget)
+
+    def recall(self, session: str, model: str = DEFAULT_MODEL, reserve: int = 0) -> Tuple[str, List[Tuple[str, str]]]:
+        """Return ``(summary, [(role, text), ...])`` fitting the model's budget.
+
+        ``reserve`` tokens are kept free for the new message.
+        """
+        summary, turns, _ = self._recall(session, model, reserve)
+        return summary, turns
+
+    def _recall(self, session: str, model: str, reserve: int) -> Tuple[str, List[Tuple[str, str]], bool]:
+        remaining = self.budget_for(model) - reserve
+        with self._lock:
+            row = self._db.execute(
+                "SELECT text, tokens, tokens + pending FROM summaries WHERE session = ?", (session,)).fetchone()
+            summary = ""
+            if row and row[0] and row[1] <= remaining:
+                summary, remaining = row[0], remaining - row[1]
+            turns: List[Tuple[str, str]] = []
+            cursor = self._db.execute(
+                "SELECT role, text, tokens FROM turns WHERE session = ? ORDER BY seq DESC", (session,))
+            for role, text, tokens in cursor:
+                if role == "tool" and tokens > self.tool_tokens:
+                    text = _clip(text, self.tool_tokens)  # not compacted yet
+                    tokens = estimate_tokens(text)
+                if tokens > remaining:
+                    break
+                turns.append((role, text))
+                remaining -= tokens
+            cursor.close()
+        turns.reverse()
+        return summary, turns, bool(row) and row[2] > self.budget_for(model)
+
+    def append(self, session: str, turns: List[Tuple[str, str]], model: str = DEFAULT_MODEL) -> bool:
+        """Store the turns of one exchange; returns whether the session is now over budget."""
+        if not turns:
+            return False
+        now = time.time()
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute("BEGIN")
+            seq = cur.execute("SELECT MAX(seq) FROM turns WHERE session = ?", (session,)).fetchone()[0]
+            if seq is None:
+                # Everything so far was folded into the summary; continue after it.
+                row = cur.execute("SELECT upto FROM summaries WHERE session = ?", (session,)).fetchone()
+                seq = row[0] if row else 0
+            added = 0
+            for role, text in turns:
+                seq += 1
+                tokens = estimate_tokens(text)
+                added += tokens
+                cur.execute("INSERT INTO turns VALUES (?, ?, ?, ?, ?)", (session, seq, role, text, tokens))
+            cur.execute(
+                "INSERT INTO summaries VALUES (?, '', 0, 0, ?, ?) ON CONFLICT(session) DO UPDATE"
+                " SET pending = pending + excluded.pending, updated = excluded.updated",
+                (session, added, now),
+            )
+            total = cur.execute("SELECT tokens + pending FROM summaries WHERE session = ?", (session,)).fetchone()[0]
+            cur.execute("COMMIT")
+            self.appends += 1
+        if self.appends % 500 == 0:
+            self.expire()
+        return total > self.budget_for(model)
+
+    async def history(self, session: str, model: str = DEFAULT_MODEL, reserve: int = 0):
+        """:meth:`recall` on a worker thread; history that is read while over
+        budget (e.g. after a context reset) gets compacted for the next turn."""
+        summary, turns, over = await asyncio.to_thread(self._recall, session, model, reserve)
+        if over:
+            self._schedule(session, model)
+        return summary, turns
+
+    async def remember(
+        self, session: str, turns: List[Tuple[str, str]], model: str = DEFAULT_MODEL, compact: bool = True,
+    ) -> None:
+        """:meth:`append` on a worker thread, then schedule compaction if over budget.
+
+        Pass ``compact=False`` while the history will not be read back (the
+        session continues a live model context); summarising it would only
+        take a model slot away from requests.
+        """
+        if await asyncio.to_thread(self.append, session, turns, model) and compact:
+            self._schedule(session, model)
+
+    def _schedule(self, session: str, model: str) -> None:
+        if session in self._tasks:
+            return
+        task = asyncio.get_running_loop().create_task(self.compact(session, model))
+        self._tasks[session] = task
+        task.add_done_callback(lambda _: self._tasks.pop(session, None))
+
+    async def compact(self, session: str, model: str = DEFAULT_MODEL) -> None:
+        """Fold turns beyond the recent half of the budget into the summary and
+        shrink oversized tool outputs that stay verbatim."""
+        budget = self.budget_for(model)
+        keep = budget // 2
+        summary_tokens = budget // 4
+        previous, rows = await asyncio.to_thread(self._load, session)
+
+        recent, old, used = [], [], 0
+        for r in rows:
+            if old or (used + min(r[3], self.tool_tokens) > keep and len(recent) >= 2):
+                old.append(r)
+            else:
+                recent.append(r)
+                used += min(r[3], self.tool_tokens)
+
+        for seq, role, text, tokens in recent:
+            if role == "tool" and tokens > self.tool_tokens:
+                short = await self._summarize(
+                    "Summarize this tool output, keeping facts the conversation may need:\n\n" + text,
+                    model, self.tool_tokens, fallback=_clip(text, self.tool_tokens))
+                await asyncio.to_thread(self._shrink, session, seq, tokens, short)
+
+        if not old:
+            return
+        old.reverse()
+        transcript = "\n".join("%s: %s" % (role.upper(), _clip(text, self.tool_tokens)) for _, role, text, _ in old)
+        instructions = (
+            "Update the running summary of a conversation with the new exchanges below. "
+            "Keep names, decisions, open questions and facts the user gave. Reply with the summary only.\n\n"
+            "CURRENT SUMMARY:\n%s\n\nNEW EXCHANGES:\n%s" % (previous or "(none)", transcript)
+        )
+        fallback = (previous + "\n" if previous else "") + "\n".join(
+            "%s: %s" % (role, text.strip().splitlines()[0][:200] if text.strip() else "") for _, role, text, _ in old)
+        summary = _clip(await self._summarize(instructions, model, summary_tokens, fallback), summary_tokens)
+        await asyncio.to_thread(self._fold, session, old[-1][0], summary)
+
+    def _load(self, session: str) -> Tuple[str, List[Tuple[int, str, str, int]]]:
+        with self._lock:
+            row = self._db.execute("SELECT text FROM summaries WHERE session = ?", (session,)).fetchone()
+            rows = self._db.execute(
+                "SELECT seq, role, text, tokens FROM turns WHERE session = ? ORDER BY seq DESC", (session,)).fetchall()
+        return (row[0] if row else ""), rows
+
+    def _shrink(self, session: str, seq: int, tokens: int, short: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE turns SET text = ?, tokens = ? WHERE session = ? AND seq = ?",
+                (short, estimate_tokens(short), session, seq))
+            self._db.execute(
+                "UPDATE summaries SET pending = pending - ? WHERE session = ?",
+                (tokens - estimate_tokens(short), session))
+
+    def _fold(self, session: str, upto: int, summary: str) -> None:
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute("BEGIN")
+            cur.execute("DELETE FROM turns WHERE session = ? AND seq <= ?", (session, upto))
+            pending = cur.execute(
+                "SELECT COALESCE(SUM(tokens), 0) FROM turns WHERE session = ?", (session,)).fetchone()[0]
+            cur.execute(
+                "UPDATE summaries SET text = ?, tokens = ?, upto = ?, pending = ?, updated = ? WHERE session = ?",
+                (summary, estimate_tokens(summary), upto, pending, time.time(), session))
+            cur.execute("COMMIT")
+            self.compactions += 1
+
+    async def _summarize(self, text: str, model: str, max_tokens: int, fallback: str) -> str:
+        # Without a model (or when it fails) a clipped extract still keeps
+        # the session inside its budget.
+        if self.summarize is None:
+            return fallback
+        try:
+            summary = (await self.summarize(text, model, max_tokens)).strip()
+        except Exception:
+            summary = ""
+        return summary or fallback
+
+    def expire(self) -> None:
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute("BEGIN")
+            stale = [r[0] for r in cur.execute("SELECT session FROM summaries WHERE updated < ?", (cutoff,))]
+            for session in stale:
+                cur.execute("DELETE FROM turns WHERE session = ?", (session,))
+                cur.execute("DELETE FROM summaries WHERE session = ?", (session,))
+            cur.execute("COMMIT")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions, tokens = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tokens + pending), 0) FROM summaries").fetchone()
+        return {
+            "sessions": sessions,
+            "stored_tokens": tokens,
+            "compactions": self.compactions,
+            "compacting": len(self._tasks),
+        }
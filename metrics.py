@@ -0,0 +1,101 @@
+# metrics.py
+# Minimal Prometheus text-format metrics: labelled histograms plus collectors
+# for gauges/counters that already live elsewhere (scheduler, caches).
+import bisect, threading, time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = ['%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"')) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # counts per bucket, then +Inf, sum
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> Iterator[str]:
+        yield "# HELP %s %s" % (self.name, self.help)
+        yield "# TYPE %s histogram" % self.name
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for key, counts in sorted(series.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else "%g" % bound
+                yield "%s_bucket%s %d" % (self.name, _labels(self.label_names, key, 'le="%s"' % le), cumulative)
+            yield "%s_sum%s %.6f" % (self.name, _labels(self.label_names, key), counts[-1])
+            yield "%s_count%s %d" % (self.name, _labels(self.label_names, key), cumulative)
+
+
+Sample = Tuple[str, Dict[str, str], float]  # (metric name, labels, value)
+
+
+class Registry:
+    def __init__(self):
+        self.histograms: List[Histogram] = []
+        self.collectors: List[Tuple[str, str, str, Callable[[], Iterable[Sample]]]] = []
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        h = Histogram(name, help, labels, buckets)
+        self.histograms.append(h)
+        return h
+
+    def collect(self, name: str, help: str, kind: str, fn: Callable[[], Iterable[Sample]]) -> None:
+        """Register ``fn`` to report current values for ``name`` at scrape time."""
+        self.collectors = [c for c in self.collectors if c[0] != name]
+        self.collectors.append((name, help, kind, fn))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for h in self.histograms:
+            lines.extend(h.render())
+        for name, help, kind, fn in self.collectors:
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for sample, labels, value in fn():
+                lines.append("%s%s %g" % (sample, _labels(list(labels), list(labels.values())), value))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram("dimi_request_seconds", "Total /chat request time.", ["mode"])
+STAGE_SECONDS = REGISTRY.histogram(
+    "dimi_stage_seconds", "Time in request stages: prompt_build, queue_wait, tool_parse.", ["stage"])
+MODEL_SECONDS = REGISTRY.histogram("dimi_model_call_seconds", "Model runtime call time.", ["model", "source"])
+MODEL_TTFT_SECONDS = REGISTRY.histogram("dimi_model_first_token_seconds", "Time to first streamed token.", ["model"])
+TOOL_SECONDS = REGISTRY.histogram("dimi_tool_seconds", "Tool execution time.", ["tool", "status"])
+PROMPT_BYTES = REGISTRY.histogram("dimi_prompt_bytes", "Prompt size sent to the model.", ["model"], SIZE_BUCKETS)
+RESPONSE_BYTES = REGISTRY.histogram("dimi_response_bytes", "Model response size.", ["model"], SIZE_BUCKETS)
+TOOL_RESULT_BYTES = REGISTRY.histogram("dimi_tool_result_bytes", "Tool output size.", ["tool"], SIZE_BUCKETS)
@@ -0,0 +1,346 @@
+# model_client.py
+# Pooled client for the local model runtime (Ollama HTTP API) with a CLI fallback
+import asyncio, json, os, re, subprocess, threading, time
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import MODEL_SECONDS, MODEL_TTFT_SECONDS, PROMPT_BYTES, RESPONSE_BYTES
+
+ANSI = re.compile(r"\x1B\[[0-?]*[ -/]*[@-~]")
+
+DEFAULT_MODEL = "qwen2.5"
+
+
+def clean(text: str) -> str:
+    return ANSI.sub('', text or '')
+
+
+def _default_base_url() -> str:
+    host = os.getenv("OLLAMA_HOST", "127.0.0.1:11434")
+    if not host.startswith(("http://", "https://")):
+        host = "http://" + host
+    return host.rstrip("/")
+
+
+@dataclass
+class Generation:
+    """One completion, or one chunk of a streamed completion (``done=False``)."""
+
+    text: str = ""
+    done: bool = True
+    ok: bool = True
+    source: str = "http"
+    context: Optional[List[int]] = None
+    prompt_eval_count: int = 0
+    eval_count: int = 0
+    stats: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_api(cls, data: Dict[str, Any]) -> "Generation":
+        return cls(
+            text=data.get("response", ""),
+            done=bool(data.get("done", True)),
+            context=data.get("context"),
+            prompt_eval_count=int(data.get("prompt_eval_count") or 0),
+            eval_count=int(data.get("eval_count") or 0),
+            stats={k: v for k, v in data.items() if k.endswith("_duration")},
+        )
+
+
+def run_cli(prompt: str, model: str = DEFAULT_MODEL) -> Generation:
+    """Legacy path: one ``ollama run`` process per completion."""
+    cmd = ["ollama", "run", model]
+    try:
+        res = subprocess.run(cmd, input=prompt, text=True, capture_output=True, check=False)
+    except FileNotFoundError:
+        return Generation(
+            text="Local model runtime not found. Please install and start Ollama before chatting.",
+            ok=False,
+            source="cli",
+        )
+
+    if res.returncode != 0:
+        details = clean(res.stderr) or "Unknown error"
+        return Generation(
+            text=f"The local model could not be reached ({res.returncode}): {details}",
+            ok=False,
+            source="cli",
+        )
+
+    return Generation(text=clean(res.stdout), source="cli")
+
+
+def _broken(exc: Exception) -> Generation:
+    return Generation(text=f"The local model failed: {exc}", ok=False)
+
+
+class ModelClient:
+    """Talks to ``/api/generate`` over a keep-alive connection pool.
+
+    Falls back to :func:`run_cli` only when the API cannot be reached at all.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        keep_alive: Optional[str] = None,
+        timeout: float = 300.0,
+        connect_timeout: float = 3.05,
+        pool_size: int = 16,
+        fallback: bool = True,
+    ):
+        self.base_url = (base_url or _default_base_url()).rstrip("/")
+        self.keep_alive = keep_alive if keep_alive is not None else os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.fallback = fallback
+
+        self.session = requests.Session()
+        # The runtime is local; don't route it through HTTP(S)_PROXY from the environment.
+        self.session.trust_env = False
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _payload(
+        self,
+        prompt: str,
+        model: str,
+        stream: bool,
+        options: Optional[Dict[str, Any]],
+        context: Optional[Sequence[int]],
+    ) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {"model": model, "prompt": prompt, "stream": stream}
+        if self.keep_alive:
+            payload["keep_alive"] = self.keep_alive
+        if options:
+            payload["options"] = options
+        if context:
+            payload["context"] = list(context)  # sessions keep it as a compact array
+        return payload
+
+    def _post(self, payload: Dict[str, Any], stream: bool) -> requests.Response:
+        return self.session.post(
+            self.base_url + "/api/generate",
+            json=payload,
+            stream=stream,
+            timeout=(self.connect_timeout, self.timeout),
+        )
+
+    @staticmethod
+    def _http_error(res: requests.Response) -> Generation:
+        try:
+            details = res.json().get("error") or res.text
+        except ValueError:
+            details = res.text
+        return Generation(
+            text=f"The local model could not be reached ({res.status_code}): {details or 'Unknown error'}",
+            ok=False,
+        )
+
+    def generate(
+        self,
+        prompt: str,
+        model: str = DEFAULT_MODEL,
+        options: Optional[Dict[str, Any]] = None,
+        context: Optional[List[int]] = None,
+    ) -> Generation:
+        started = time.perf_counter()
+        result = self._generate(prompt, model, options, context)
+        MODEL_SECONDS.observe(time.perf_counter() - started, model=model, source=result.source)
+        PROMPT_BYTES.observe(len(prompt.encode("utf-8")), model=model)
+        RESPONSE_BYTES.observe(len(result.text.encode("utf-8")), model=model)
+        return result
+
+    def _generate(
+        self,
+        prompt: str,
+        model: str,
+        options: Optional[Dict[str, Any]],
+        context: Optional[List[int]],
+    ) -> Generation:
+        try:
+            res = self._post(self._payload(prompt, model, False, options, context), stream=False)
+        except requests.ConnectionError:
+            if not self.fallback:
+                raise
+            return run_cli(prompt, model)
+        except requests.Timeout:
+            return Generation(text="The local model timed out.", ok=False)
+        except requests.RequestException as exc:
+            return _broken(exc)
+
+        if res.status_code != 200:
+            return self._http_error(res)
+        try:
+            return Generation.from_api(res.json())
+        except (requests.RequestException, ValueError) as exc:
+            return _broken(exc)
+
+    def stream(
+        self,
+        prompt: str,
+        model: str = DEFAULT_MODEL,
+        options: Optional[Dict[str, Any]] = None,
+        context: Optional[List[int]] = None,
+    ) -> Iterator[Generation]:
+        """Yield token chunks, then a final ``done=True`` chunk carrying stats/context.
+
+        Closing the generator early closes the HTTP response, which makes the
+        runtime abandon the generation.
+        """
+        started = time.perf_counter()
+        source, size, first = "http", 0, True
+        PROMPT_BYTES.observe(len(prompt.encode("utf-8")), model=model)
+        try:
+            for chunk in self._stream(prompt, model, options, context):
+                if first and chunk.text:
+                    MODEL_TTFT_SECONDS.observe(time.perf_counter() - started, model=model)
+                    first = False
+                source = chunk.source
+                size += len(chunk.text.encode("utf-8"))
+                yield chunk
+        finally:
+            MODEL_SECONDS.observe(time.perf_counter() - started, model=model, source=source)
+            RESPONSE_BYTES.observe(size, model=model)
+
+    def _stream(
+        self,
+        prompt: str,
+        model: str,
+        options: Optional[Dict[str, Any]],
+        context: Optional[List[int]],
+    ) -> Iterator[Generation]:
+        try:
+            res = self._post(self._payload(prompt, model, True, options, context), stream=True)
+        except requests.ConnectionError:
+            if not self.fallback:
+                raise
+            yield run_cli(prompt, model)
+            return
+        except requests.Timeout:
+            yield Generation(text="The local model timed out.", ok=False)
+            return
+        except requests.RequestException as exc:
+            yield _broken(exc)
+            return
+
+        with res:
+            if res.status_code != 200:
+                yield self._http_error(res)
+                return
+            try:
+                for line in res.iter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data.get("error"):
+                        yield Generation(text=f"The local model failed: {data['error']}", ok=False)
+                        return
+                    if data.get("done"):
+                        # Read the end of the chunked body first; a response
+                        # closed before that takes its connection out of the pool.
+                        for _ in res.iter_lines():
+                            pass
+                        yield Generation.from_api(data)
+                        return
+                    yield Generation.from_api(data)
+            except (requests.RequestException, ValueError) as exc:
+                # Dropped connection, read timeout or a garbled line mid-generation.
+                yield _broken(exc)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncModelClient:
+    """Asyncio front-end for :class:`ModelClient`.
+
+    Requests run on worker threads so they share the sync client's connection
+    pool; nothing blocks the event loop.
+    """
+
+    def __init__(self, client: Optional[ModelClient] = None, **kwargs: Any):
+        self.client = client or ModelClient(**kwargs)
+
+    async def generate(
+        self,
+        prompt: str,
+        model: str = DEFAULT_MODEL,
+        options: Optional[Dict[str, Any]] = None,
+        context: Optional[List[int]] = None,
+    ) -> Generation:
+        # Built on stream() so that cancelling (e.g. a request timeout) also
+        # aborts the generation upstream instead of leaving a thread behind.
+        text: List[str] = []
+        final = Generation(text="", ok=False)
+        async with aclosing(self.stream(prompt, model, options, context)) as chunks:
+            async for chunk in chunks:
+                if not chunk.ok:
+                    return chunk
+                text.append(chunk.text)
+                final = chunk
+        final.text = "".join(text)
+        final.ok = True
+        return final
+
+    async def stream(
+        self,
+        prompt: str,
+        model: str = DEFAULT_MODEL,
+        options: Optional[Dict[str, Any]] = None,
+        context: Optional[List[int]] = None,
+    ) -> AsyncIterator[Generation]:
+        loop = asyncio.get_running_loop()
+        queue: "asyncio.Queue[Optional[Generation]]" = asyncio.Queue()
+        stop = threading.Event()
+        failure: List[BaseException] = []
+
+        def pump() -> None:
+            chunks = self.client.stream(prompt, model, options, context)
+            try:
+                for chunk in chunks:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            except BaseException as exc:  # handed to the consumer below
+                failure.append(exc)
+            finally:
+                chunks.close()
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        worker = loop.run_in_executor(None, pump)
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                yield chunk
+            if failure:
+                raise failure[0]
+        finally:
+            # Consumer finished or went away (e.g. client disconnect): stop the
+            # pump so the HTTP response is closed and the generation aborted.
+            stop.set()
+            if worker.done() and not worker.cancelled():
+                worker.exception()
+
+    def close(self) -> None:
+        self.client.close()
+
+
+_default_client: Optional[ModelClient] = None
+_default_lock = threading.Lock()
+
+
+def get_client() -> ModelClient:
+    global _default_client
+    if _default_client is None:
+        with _default_lock:
+            if _default_client is None:
+                _default_client = ModelClient()
+    return _default_client
@@ -0,0 +1,196 @@
+# scheduler.py
+# Admission control for model generations: bounded concurrency per model,
+# a bounded FIFO wait queue, and fast rejection when the box is saturated.
+import asyncio, math, os, time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from metrics import STAGE_SECONDS
+
+
+class Overloaded(Exception):
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(Overloaded):
+    status_code = 429
+
+
+class QueueTimeout(Overloaded):
+    status_code = 503
+
+
+class ModelQueue:
+    """Counting semaphore with strict FIFO hand-off and a bounded wait list."""
+
+    def __init__(self, model: str, max_concurrent: int, max_queue: int):
+        self.model = model
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.service_avg = 0.0  # EWMA of slot hold time, seconds
+
+    def retry_after(self) -> int:
+        per_slot = self.service_avg or 1.0
+        ahead = len(self.waiters) + 1
+        return max(1, math.ceil(per_slot * ahead / self.max_concurrent))
+
+    def check(self) -> None:
+        """Raise :class:`QueueFull` now if a new request could not even queue."""
+        if self.active >= self.max_concurrent and len(self.waiters) >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull(f"{self.model}: queue full", self.retry_after())
+
+    async def acquire(self, timeout: Optional[float]) -> float:
+        """Take a slot, waiting in line if needed; returns seconds spent waiting."""
+        if self.active < self.max_concurrent and not self.waiters:
+            self.active += 1
+            self._admitted(0.0)
+            return 0.0
+        self.check()
+
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.append(fut)
+        started = time.monotonic()
+        try:
+            done, _ = await asyncio.wait({fut}, timeout=timeout)
+        except asyncio.CancelledError:
+            self._abandon(fut)
+            raise
+        if not done:
+            self._abandon(fut)
+            self.timed_out += 1
+            raise QueueTimeout(f"{self.model}: timed out waiting for a free slot", self.retry_after())
+
+        waited = time.monotonic() - started
+        self._admitted(waited)
+        return waited
+
+    def release(self, held: float = 0.0) -> None:
+        if held:
+            self.service_avg = held if not self.service_avg else 0.8 * self.service_avg + 0.2 * held
+        while self.waiters:
+            fut = self.waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)  # the slot passes straight to the next waiter
+                return
+        self.active -= 1
+
+    def _abandon(self, fut: asyncio.Future) -> None:
+        if fut.done() and not fut.cancelled():
+            self.release()  # we were handed a slot we will not use
+            return
+        fut.cancel()
+        try:
+            self.waiters.remove(fut)
+        except ValueError:
+            pass
+
+    def _admitted(self, waited: float) -> None:
+        self.admitted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "queued": len(self.waiters),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_avg_ms": round(1000 * self.wait_total / self.admitted, 2) if self.admitted else 0.0,
+            "wait_max_ms": round(1000 * self.wait_max, 2),
+            "service_avg_ms": round(1000 * self.service_avg, 2),
+        }
+
+
+class Reservation:
+    """A slot taken ahead of use, e.g. before a streaming response starts.
+
+    ``async with`` it to run under the slot; :meth:`release` frees it and is
+    safe to call again, so an unused reservation can always be dropped.
+    """
+
+    def __init__(self, queue: ModelQueue, waited: float):
+        self.queue = queue
+        self.waited = waited
+        self.held = True
+        self.started: Optional[float] = None
+
+    async def __aenter__(self) -> float:
+        self.started = time.monotonic()
+        return self.waited
+
+    async def __aexit__(self, *exc: Any) -> None:
+        self.release()
+
+    def release(self) -> None:
+        if self.held:
+            self.held = False
+            self.queue.release(time.monotonic() - self.started if self.started is not None else 0.0)
+
+
+class Scheduler:
+    def __init__(
+        self,
+        max_concurrent: int = 1,
+        max_queue: int = 16,
+        queue_timeout: float = 30.0,
+        request_timeout: float = 300.0,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.queues: Dict[str, ModelQueue] = {}
+
+    @classmethod
+    def from_env(cls) -> "Scheduler":
+        return cls(
+            max_concurrent=int(os.getenv("DIMI_MAX_CONCURRENT", "1")),
+            max_queue=int(os.getenv("DIMI_MAX_QUEUE", "16")),
+            queue_timeout=float(os.getenv("DIMI_QUEUE_TIMEOUT", "30")),
+            request_timeout=float(os.getenv("DIMI_REQUEST_TIMEOUT", "300")),
+        )
+
+    def queue(self, model: str) -> ModelQueue:
+        q = self.queues.get(model)
+        if q is None:
+            q = self.queues[model] = ModelQueue(model, self.max_concurrent, self.max_queue)
+        return q
+
+    def deadline(self) -> float:
+        return asyncio.get_running_loop().time() + self.request_timeout
+
+    async def reserve(self, model: str, deadline: Optional[float] = None) -> Reservation:
+        """Wait for a generation slot for ``model``; raises :class:`Overloaded`."""
+        timeout = self.queue_timeout
+        if deadline is not None:
+            timeout = min(timeout, max(0.0, deadline - asyncio.get_running_loop().time()))
+        q = self.queue(model)
+        waited = await q.acquire(timeout)
+        STAGE_SECONDS.observe(waited, stage="queue_wait")
+        return Reservation(q, waited)
+
+    @asynccontextmanager
+    async def slot(self, model: str, deadline: Optional[float] = None) -> AsyncIterator[float]:
+        """Hold one generation slot for ``model``; yields the queue wait in seconds."""
+        async with await self.reserve(model, deadline) as waited:
+            yield waited
+
+    def stats(self) -> Dict[str, Any]:
+        return {model: q.stats() for model, q in self.queues.items()}
@@ -0,0 +1,124 @@
+# sessions.py
+# Per-conversation model context, so follow-up calls only send new tokens
+import asyncio, os, time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from model_client import Generation
+
+
+@dataclass
+class Session:
+    id: Optional[str]
+    context: Optional["array[int]"] = None  # 4 bytes a token, not a boxed int
+    turns: int = 0
+    calls: int = 0
+    resets: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    def record(self, result: Generation, max_context: int) -> None:
+        """Account for one model call and keep the context it returned."""
+        self.calls += 1
+        self.prompt_tokens += result.prompt_eval_count
+        self.completion_tokens += result.eval_count
+        if not result.ok:
+            return
+        self.context = None
+        if result.context and len(result.context) > max_context:
+            # Too long to keep extending; the next turn starts from the system prompt.
+            self.resets += 1
+        elif result.context:
+            self.context = array("i", result.context)
+
+
+class SessionStore:
+    """Bounded LRU of sessions keyed by the client-supplied session id."""
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 3600.0, max_context: int = 8192, reuse: bool = True):
+        self.max_sessions = max_sessions
+        self.reuse = reuse
+        self.ttl = ttl
+        self.max_context = max_context
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.evicted = 0
+        self.turns = 0
+        self.reused_turns = 0
+        self.prompt_tokens = 0
+
+    @classmethod
+    def from_env(cls) -> "SessionStore":
+        return cls(
+            max_sessions=int(os.getenv("DIMI_MAX_SESSIONS", "1000")),
+            ttl=float(os.getenv("DIMI_SESSION_TTL", "3600")),
+            max_context=int(os.getenv("DIMI_MAX_CONTEXT", "8192")),
+            reuse=os.getenv("DIMI_CONTEXT_REUSE", "1") != "0",
+        )
+
+    def get(self, session_id: Optional[str]) -> Session:
+        """Return the session for ``session_id``; without an id (or with reuse
+        off) the session is throw-away and only lives for a single turn."""
+        if not session_id or not self.reuse:
+            return Session(session_id or None)
+        self._expire()
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = Session(session_id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evicted += 1
+        self.sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+        return session
+
+    def record(self, session: Session, result: Generation) -> None:
+        session.record(result, self.max_context)
+        if not self.reuse:
+            session.context = None
+
+    def begin_turn(self, session: Session) -> Dict[str, Any]:
+        return {
+            "started": time.monotonic(),
+            "calls": session.calls,
+            "prompt_tokens": session.prompt_tokens,
+            "completion_tokens": session.completion_tokens,
+            "reused": session.context is not None,
+        }
+
+    def end_turn(self, session: Session, turn: Dict[str, Any]) -> Dict[str, Any]:
+        """Close a turn opened with :meth:`begin_turn`; returns its usage."""
+        session.turns += 1
+        usage = {
+            "model_calls": session.calls - turn["calls"],
+            "prompt_tokens": session.prompt_tokens - turn["prompt_tokens"],
+            "completion_tokens": session.completion_tokens - turn["completion_tokens"],
+            "context_reused": turn["reused"],
+            "latency_ms": round(1000 * (time.monotonic() - turn["started"]), 1),
+        }
+        self.turns += 1
+        self.reused_turns += int(turn["reused"])
+        self.prompt_tokens += usage["prompt_tokens"]
+        return usage
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.ttl
+        while self.sessions:
+            oldest = next(iter(self.sessions.values()))
+            if oldest.last_used >= cutoff or oldest.lock.locked():
+                break
+            self.sessions.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self.sessions),
+            "evicted": self.evicted,
+            "turns": self.turns,
+            "reused_turns": self.reused_turns,
+            "prompt_tokens_per_turn": round(self.prompt_tokens / self.turns, 1) if self.turns else 0.0,
+            "context_tokens": sum(len(s.context or ()) for s in self.sessions.values()),
+        }
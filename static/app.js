@@ -3,6 +3,8 @@ const input = document.getElementById('user-input');
 const sendBtn = document.getElementById('send-btn');
 const statusLine = document.getElementById('status-line');
 const form = document.getElementById('chat-form');
+// Lets the server continue the model context from the previous turn.
+const sessionId = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
 
 function appendMessage(text, sender = 'bot') {
     const row = document.createElement('div');
@@ -26,6 +28,7 @@ function appendMessage(text, sender = 'bot') {
 
     chatArea.appendChild(row);
     chatArea.scrollTop = chatArea.scrollHeight;
+    return bubble;
 }
 
 function setStatus(text, state = 'ok') {
@@ -51,6 +54,27 @@ function showTyping() {
     return indicator;
 }
 
+async function readEvents(body, onEvent) {
+    // The streaming /chat response is NDJSON: one JSON event per line.
+    const reader = body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+
+        let newline;
+        while ((newline = buffered.indexOf('\n')) >= 0) {
+            const line = buffered.slice(0, newline).trim();
+            buffered = buffered.slice(newline + 1);
+            if (line) onEvent(JSON.parse(line));
+        }
+        if (done) break;
+    }
+    if (buffered.trim()) onEvent(JSON.parse(buffered));
+}
+
 async function sendMessage() {
     const text = input.value.trim();
     if (!text) return;
@@ -67,13 +91,31 @@ async function sendMessage() {
         const res = await fetch('/chat', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ message: text })
+            body: JSON.stringify({ message: text, stream: true, session_id: sessionId })
+        });
+
+        if (!res.ok || !res.body) throw new Error(`Request failed: ${res.status}`);
+
+        let bubble = null;
+        await readEvents(res.body, (event) => {
+            if (event.type === 'token') {
+                if (!bubble) {
+                    typingIndicator.remove();
+                    bubble = appendMessage('', 'bot');
+                }
+                bubble.textContent += event.text;
+                chatArea.scrollTop = chatArea.scrollHeight;
+            } else if (event.type === 'tool_start') {
+                setStatus(`Running tool ${event.tool}...`, 'warn');
+            } else if (event.type === 'tool_end') {
+                setStatus('Sending to local model...', 'warn');
+            } else if (event.type === 'error') {
+                throw new Error(event.message);
+            }
         });
 
-        if (!res.ok) throw new Error(`Request failed: ${res.status}`);
-        const data = await res.json();
         typingIndicator.remove();
-        appendMessage(data.reply || 'No reply received.', 'bot');
+        if (!bubble) appendMessage('No reply received.', 'bot');
         setStatus('Connected to local workspace', 'ok');
     } catch (err) {
         typingIndicator.remove();
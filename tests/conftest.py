@@ -0,0 +1,11 @@
+# conftest.py
+# The modules live at the repo root; keep tests off the user's real caches.
+import os, sys, tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+_tmp = tempfile.mkdtemp(prefix="dimi-tests-")
+os.environ.setdefault("DIMI_HTTP_CACHE", "0")
+os.environ.setdefault("DIMI_GEN_CACHE", "0")
+os.environ.setdefault("DIMI_MEMORY_PATH", os.path.join(_tmp, "memory.sqlite"))
@@ -0,0 +1,86 @@
+# test_agent_core.py
+# Tool-call detection: streamed (ToolCallHold) and whole-reply (extract_tool_calls).
+import random, time
+
+import pytest
+
+from agent_core import ToolCallHold, user_prompt
+from agent_tools import extract_tool_calls
+
+REPLIES = [
+    '{"tool": "read_file", "args": {"path": "a.txt"}}',
+    'Let me check. {"tool": "read_file", "args": {"path": "x"}}',
+    'Sure!\n```json\n{"tool": "echo", "args": {"text": "hi"}}\n```\n',
+    '[{"tool": "a", "args": {}}, {"tool": "b"}] then {"tool_calls": [{"tool": "c"}]}',
+    'x {"args": {}, "tool": "late"} y',
+    'Use {x} and [1, 2] here, or {"a": 1}. Done.',
+    'function f() { return {"a": [1, 2]}; }',
+    '{"tool": "bad", "args": {"flag": tru}} after',
+    '"tool" ' + '[1, ' * 3000,
+    'plain text with a `tick` and ``` fences ```',
+]
+
+
+def _stream(reply, rng):
+    hold, out, i = ToolCallHold(), "", 0
+    while i < len(reply):
+        n = rng.randint(1, 8)
+        out += hold.feed(reply[i:i + n])
+        i += n
+    rest, calls = hold.finish()
+    return out, rest, calls
+
+
+@pytest.mark.parametrize("reply", REPLIES)
+def test_stream_and_whole_reply_find_the_same_calls(reply):
+    want = extract_tool_calls(reply)
+    rng = random.Random(reply)
+    for _ in range(50):
+        out, rest, calls = _stream(reply, rng)
+        assert calls == want
+        if calls:
+            assert '"tool' not in out  # the call was never shown to the user
+        else:
+            assert out + rest == reply
+
+
+def test_prose_is_released_as_it_arrives():
+    hold = ToolCallHold()
+    assert hold.feed("See [a] and {b} ok ") == "See [a] and {b} ok "
+    assert hold.feed("{") == ""
+    assert hold.feed('"x": 1} then') == '{"x": 1} then'
+
+
+def test_json_fence_is_held_with_its_call():
+    hold = ToolCallHold()
+    assert hold.feed("Calling:\n```js") == "Calling:\n"
+    assert hold.feed('on\n{"tool": "echo"}\n```') == ""
+    assert hold.finish() == ("", [("echo", {})])
+
+
+def test_finish_without_tools_releases_everything():
+    hold = ToolCallHold()
+    hold.feed('{"tool": "echo", "args": {}}')
+    assert hold.finish(tools=False) == ('{"tool": "echo", "args": {}}', [])
+
+
+def test_extract_tool_calls_shapes():
+    assert extract_tool_calls('{"tool": "a", "args": {"k": 1}}') == [("a", {"k": 1})]
+    assert extract_tool_calls('[{"tool": "a"}, {"tool": "b", "args": []}]') == [("a", {}), ("b", {})]
+    assert extract_tool_calls('{"tool_calls": [{"tool": "a"}]}') == [("a", {})]
+    assert extract_tool_calls('no tools here {"a": 1}') == []
+
+
+def test_extract_tool_calls_survives_hostile_input():
+    assert extract_tool_calls('"tool' + '[1, ' * 20000) == []
+    started = time.perf_counter()
+    assert extract_tool_calls('"tool ' + '[1] {"a": x} ' * 3000) == []
+    assert time.perf_counter() - started < 0.5
+
+
+def test_user_prompt_renders_history():
+    prompt = user_prompt("new?", history=("earlier summary", [("user", "hi"), ("tool", "echo returned:\nx")]))
+    assert "CONVERSATION SUMMARY:\nearlier summary" in prompt
+    assert prompt.index("USER:\nhi") < prompt.index("TOOL RESULT:\necho") < prompt.index("USER:\nnew?")
+    assert prompt.endswith("ASSISTANT:")
+    assert user_prompt("q", with_system=False) == "\nUSER:\nq\nASSISTANT:"
@@ -0,0 +1,155 @@
+# test_app.py
+# /chat end to end: the app under uvicorn (bench.serve_app) against the stub runtime.
+import asyncio, json, time
+
+import pytest
+import requests
+
+from bench import StubModelServer, ToolCallingStub, serve_app
+from model_client import AsyncModelClient, ModelClient
+
+
+@pytest.fixture(scope="module")
+def url():
+    server, base = serve_app()
+    yield base
+    server.should_exit = True
+
+
+@pytest.fixture
+def runtime(monkeypatch):
+    """Point the app at a stub runtime: ``runtime(StubClass, **kwargs)``."""
+    import app
+
+    stubs = []
+
+    def start(cls=StubModelServer, **kwargs):
+        stub = cls(**kwargs).__enter__()
+        stubs.append(stub)
+        monkeypatch.setattr(app, "model_client", AsyncModelClient(ModelClient(base_url=stub.base_url, fallback=False)))
+        return stub
+
+    yield start
+    for stub in stubs:
+        stub.__exit__(None, None, None)
+
+
+def _events(url, body):
+    with requests.post(url + "/chat", json=dict(body, stream=True), stream=True) as res:
+        assert res.status_code == 200
+        assert res.headers["content-type"].startswith("application/x-ndjson")
+        return [json.loads(line) for line in res.iter_lines() if line]
+
+
+def test_stream_tokens_then_done(url, runtime):
+    runtime(tokens=3)
+    events = _events(url, {"message": "hi", "cache": False})
+    assert [e["type"] for e in events] == ["token", "token", "token", "done"]
+    assert "".join(e["text"] for e in events[:-1]) == events[-1]["reply"] == "tok0 tok1 tok2 "
+    assert events[-1]["usage"]["model_calls"] == 1 and events[-1]["usage"]["tool_calls"] == 0
+
+
+def test_stream_tool_round(url, runtime):
+    stub = runtime(ToolCallingStub, tokens=2)
+    events = _events(url, {"message": "use a tool", "cache": False})
+    kinds = [e["type"] for e in events]
+    assert kinds == ["tool_start", "tool_end", "token", "token", "done"]
+    assert events[0]["tool"] == "echo" and events[0]["args"] == {"text": "x" * 200}
+    assert events[1]["tool"] == "echo" and events[1]["chars"] == 200
+    assert events[-1]["reply"] == "tok0 tok1 "  # the tool call itself is never shown
+    assert events[-1]["usage"]["tool_calls"] == 1 and stub.calls == 2
+
+
+class GoneClient:
+    """Stands in for the Request of a client that has already hung up."""
+
+    async def is_disconnected(self):
+        return True
+
+
+def test_disconnect_abandons_the_turn(runtime, monkeypatch):
+    import app
+    from scheduler import Scheduler
+
+    monkeypatch.setattr(app, "scheduler", Scheduler.from_env())  # not bound to the server's loop
+    stub = runtime(ToolCallingStub, tokens=2)
+    session_id = "gone-%s" % time.time()
+    session = app.sessions.get(session_id)
+    session.context = before = [1, 2, 3]
+
+    async def main():
+        params = {"options": None, "cache": False}
+        events = app.chat_events("use a tool", session, GoneClient(), app.scheduler.deadline(), params)
+        return [e async for e in events]
+
+    assert asyncio.run(main()) == [b""]  # admission only: no tool events, no done
+    assert stub.calls == 1  # the tool round never started
+    assert session.context == before
+    assert app.memory.recall(session_id)[1] == []
+
+
+def _stream_requests():
+    from metrics import REGISTRY
+
+    for line in REGISTRY.render().splitlines():
+        if line.startswith('dimi_request_seconds_count{mode="stream"}'):
+            return int(line.split()[-1])
+    return 0
+
+
+def test_rejected_stream_is_timed(monkeypatch):
+    import app
+    from scheduler import Overloaded, Scheduler
+
+    monkeypatch.setattr(app, "scheduler", Scheduler(max_concurrent=1, max_queue=0))
+    session = app.sessions.get(None)
+
+    async def main():
+        busy = await app.scheduler.reserve(app.DEFAULT_MODEL, app.scheduler.deadline())
+        events = app.chat_events("hi", session, GoneClient(), app.scheduler.deadline(), {})
+        try:
+            with pytest.raises(Overloaded):
+                await anext(events)
+        finally:
+            busy.release()
+
+    before = _stream_requests()
+    asyncio.run(main())
+    assert _stream_requests() == before + 1
+
+
+class ContextStub(StubModelServer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.contexts = []
+
+    def handle(self, h, req):
+        self.contexts.append(req.get("context"))
+        super().handle(h, req)
+
+
+def test_follow_up_turn_reuses_the_context(url, runtime):
+    import app
+
+    stub = runtime(ContextStub, tokens=2)
+    body = {"message": "hello", "session_id": "reuse-%s" % time.time(), "cache": False}
+    first = requests.post(url + "/chat", json=body).json()
+    kept = app.sessions.get(body["session_id"]).context
+    assert kept.itemsize == 4  # stored compactly, not as a list of ints
+    second = _events(url, dict(body, message="again"))[-1]
+    assert not first["usage"]["context_reused"] and second["usage"]["context_reused"]
+    assert stub.contexts == [None, kept.tolist()]
+    # Only the new turn is prefilled: the reused context counts as evaluated.
+    assert second["usage"]["prompt_tokens"] < first["usage"]["prompt_tokens"]
+
+
+def test_metrics_endpoint(url, runtime):
+    runtime(tokens=1)
+    requests.post(url + "/chat", json={"message": "hi", "cache": False})
+    res = requests.get(url + "/metrics")
+    assert res.status_code == 200 and res.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = res.text.splitlines()
+    assert "# TYPE dimi_request_seconds histogram" in lines
+    assert any(line.startswith('dimi_request_seconds_count{mode="json"} ') for line in lines)
+    assert any(line.startswith('dimi_stage_seconds_count{stage="prompt_build"} ') for line in lines)
+    assert "# TYPE dimi_scheduler_active gauge" in lines and "# TYPE dimi_sessions gauge" in lines
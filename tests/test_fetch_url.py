@@ -0,0 +1,139 @@
+# test_fetch_url.py
+# fetch_url and its response cache against a local http.server stub.
+import gzip, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import agent_tools
+from agent_tools import _fetch_url
+from http_cache import ResponseCache
+
+
+class Stub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.routes = {}  # path -> (headers, body); a callable body streams
+        self.requests = []
+        self.sent = 0
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def handle_error(self, request, client_address):
+        pass  # the client hanging up early is part of the test
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        headers, body = self.server.routes[self.path]
+        etag = headers.get("ETag")
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", headers.get("Cache-Control", "max-age=0"))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if callable(body):
+            self.send_header("Content-Length", str(body.total))
+            self.end_headers()
+            for chunk in body():
+                self.wfile.write(chunk)
+                self.server.sent += len(chunk)
+            return
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stub():
+    server = Stub()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    c = ResponseCache(str(tmp_path / "http.sqlite"))
+    monkeypatch.setattr(agent_tools, "_cache", c)
+    return c
+
+
+def test_fresh_hit_skips_the_network(stub, cache):
+    stub.routes["/a"] = ({"Cache-Control": "max-age=60"}, b"hello")
+    assert _fetch_url(stub.url + "/a") == "hello"
+    assert _fetch_url(stub.url + "/a") == "hello"
+    assert len(stub.requests) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_stale_entry_revalidates_with_304(stub, cache):
+    stub.routes["/b"] = ({"ETag": '"v1"', "Cache-Control": "no-cache"}, b"body v1")
+    assert _fetch_url(stub.url + "/b") == "body v1"
+    assert _fetch_url(stub.url + "/b") == "body v1"
+    assert len(stub.requests) == 2
+    assert stub.requests[1][1].get("If-None-Match") == '"v1"'
+    assert cache.revalidated == 1
+
+
+def test_no_store_is_not_cached(stub, cache):
+    stub.routes["/c"] = ({"Cache-Control": "no-store", "ETag": '"x"'}, b"secret")
+    assert _fetch_url(stub.url + "/c") == "secret"
+    assert _fetch_url(stub.url + "/c") == "secret"
+    assert len(stub.requests) == 2
+    assert cache.get(stub.url + "/c") is None
+
+
+def test_large_body_stops_reading_at_the_limit(stub, cache):
+    chunk = b"x" * 65536
+
+    def body():
+        for _ in range(512):
+            yield chunk
+    body.total = len(chunk) * 512  # 32 MB
+
+    stub.routes["/big"] = ({"Cache-Control": "max-age=60"}, body)
+    out = _fetch_url(stub.url + "/big", limit=1000)
+    assert out.startswith("x" * 1000)
+    assert out.endswith("(truncated, total %d bytes)" % body.total)
+    time.sleep(0.2)
+    assert stub.sent < body.total // 2
+    # The partial entry only answers requests it covers.
+    assert _fetch_url(stub.url + "/big", limit=500).startswith("x" * 500)
+    assert len(stub.requests) == 1
+
+
+def test_gzip_total_is_not_the_compressed_size(stub, cache):
+    text = "y" * 5000
+    stub.routes["/gz"] = ({"Content-Encoding": "gzip"}, gzip.compress(text.encode()))
+    out = _fetch_url(stub.url + "/gz", limit=100)
+    assert out.startswith("y" * 100)
+    assert out.endswith("\n... (truncated)")  # no compressed byte count
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path):
+    c = ResponseCache(str(tmp_path / "http.sqlite"), max_bytes=3000)
+    headers = {"Cache-Control": "max-age=60"}
+    for name in ("a", "b", "c"):
+        c.put("http://h/" + name, headers, name * 900, complete=True)
+        time.sleep(0.01)
+    c.get("http://h/a")  # now more recent than b
+    c.put("http://h/d", headers, "d" * 900, complete=True)
+    assert c.get("http://h/b") is None
+    assert c.get("http://h/a") is not None and c.get("http://h/d") is not None
@@ -0,0 +1,78 @@
+# test_file_tools.py
+import time, tracemalloc
+
+from file_tools import DEFAULT_MAX_BYTES, read_file
+
+
+def _big(tmp_path, size=4 * 1024 * 1024):
+    p = tmp_path / "big.txt"
+    with p.open("wb") as f:
+        line = b"x" * 99 + b"\n"
+        f.write(line * (size // len(line)))
+    return p
+
+
+def test_negative_length_uses_budget(tmp_path):
+    p = _big(tmp_path)
+    tracemalloc.start()
+    out = read_file({"path": str(p), "length": -1})
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert out.startswith("x" * 99)
+    assert "continue with offset=%d" % DEFAULT_MAX_BYTES in out
+    assert len(out) < DEFAULT_MAX_BYTES + 200
+    assert peak < 1024 * 1024
+
+
+def test_negative_offset_and_zero_length(tmp_path):
+    p = _big(tmp_path, 10_000)
+    out = read_file({"path": str(p), "offset": -50, "length": 0, "max_bytes": 100})
+    assert out.startswith("x" * 99 + "\n\n...")
+    assert "bytes 0-100 of" in out
+
+
+def _numbered(tmp_path, n=1000):
+    p = tmp_path / "lines.txt"
+    p.write_text("".join("line %d\n" % i for i in range(1, n + 1)))
+    return p
+
+
+def test_head_and_tail(tmp_path):
+    p = _numbered(tmp_path)
+    assert read_file({"path": str(p), "mode": "head", "lines": 3}) == "line 1\nline 2\nline 3\n"
+    assert read_file({"path": str(p), "mode": "tail", "lines": 2}) == "line 999\nline 1000\n"
+    out = read_file({"path": str(p), "mode": "tail", "lines": 500, "max_bytes": 20})
+    assert out.startswith("... (truncated)\n") and out.endswith("line 1000\n")
+
+
+def test_line_range(tmp_path):
+    p = _numbered(tmp_path)
+    assert read_file({"path": str(p), "start_line": 10, "end_line": 12}) == "line 10\nline 11\nline 12\n"
+    assert read_file({"path": str(p), "start_line": 5000}) == ""
+    out = read_file({"path": str(p), "start_line": 1, "max_bytes": 10})
+    assert out == "line 1\nlin\n... (truncated at 10 bytes)"
+
+
+def test_grep_is_literal_by_default(tmp_path):
+    p = tmp_path / "g.txt"
+    p.write_text("a.c\nabc\nA.C\n(a+)+$ literal\n" + "a" * 40 + "!\n")
+    path = str(p)
+    assert read_file({"path": path, "mode": "grep", "pattern": "a.c"}) == "1: a.c\n"
+    assert read_file({"path": path, "mode": "grep", "pattern": "a.c", "ignore_case": True}) == "1: a.c\n3: A.C\n"
+    assert read_file({"path": path, "mode": "grep", "pattern": "(a+)+$"}) == "4: (a+)+$ literal\n"
+    assert read_file({"path": path, "mode": "grep", "pattern": "zzz"}) == "No matches"
+    out = read_file({"path": path, "mode": "grep", "pattern": "a", "max_matches": 2})
+    assert out.endswith("... (stopped after 2 matches)\n")
+
+
+def test_grep_regex_runs_in_a_killable_child(tmp_path, monkeypatch):
+    import file_tools
+    p = tmp_path / "g.txt"
+    p.write_text("abc\nxyz\n" + "a" * 40 + "!\n")
+    path = str(p)
+    assert read_file({"path": path, "mode": "grep", "pattern": "^x.z$", "regex": True}) == "2: xyz\n"
+    assert read_file({"path": path, "mode": "grep", "pattern": "(", "regex": True}).startswith("Invalid pattern")
+    monkeypatch.setattr(file_tools, "REGEX_TIMEOUT", 0.5)
+    started = time.perf_counter()
+    out = read_file({"path": path, "mode": "grep", "pattern": "(a+)+$", "regex": True})
+    assert out.startswith("Regex search stopped") and time.perf_counter() - started < 3
@@ -0,0 +1,132 @@
+# test_gen_cache.py
+import asyncio, sqlite3, threading, time
+
+from gen_cache import GenerationCache
+from model_client import Generation
+
+
+def _db_rows(path):
+    with sqlite3.connect(str(path)) as db:
+        return db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generations").fetchone()
+
+
+def test_db_is_size_bounded(tmp_path):
+    path = tmp_path / "gen.sqlite"
+    cache = GenerationCache(max_entries=4, path=str(path), max_db_bytes=20_000)
+    for i in range(50):
+        cache.put(cache.key("m", "prompt %d" % i), Generation(text="x" * 1000, context=list(range(50))))
+    count, size = _db_rows(path)
+    assert size <= 20_000 and count < 50
+    assert cache.db_bytes == size
+    # Oldest rows went first; the newest is still there after a restart.
+    again = GenerationCache(max_entries=4, path=str(path), max_db_bytes=20_000)
+    assert again.get(again.key("m", "prompt 49")).text == "x" * 1000
+    assert again.get(again.key("m", "prompt 0")) is None
+
+
+def test_expired_rows_are_purged(tmp_path):
+    path = tmp_path / "gen.sqlite"
+    cache = GenerationCache(ttl=0.01, path=str(path))
+    for i in range(5):
+        cache.put(cache.key("m", str(i)), Generation(text="old"))
+    time.sleep(0.05)
+    GenerationCache(path=str(path))
+    assert _db_rows(path) == (0, 0)
+
+
+def test_expired_rows_are_purged_while_running(tmp_path):
+    path = tmp_path / "gen.sqlite"
+    cache = GenerationCache(ttl=0.01, path=str(path))
+    cache.put(cache.key("m", "a"), Generation(text="old"))
+    time.sleep(0.05)
+    cache.put(cache.key("m", "b"), Generation(text="new"))
+    assert _db_rows(path)[0] == 1
+
+
+def test_concurrent_identical_requests_share_one_generation():
+    cache = GenerationCache()
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return Generation(text="answer", prompt_eval_count=10, eval_count=5)
+
+    async def main():
+        key = cache.key("m", "same prompt")
+        return await asyncio.gather(*(cache.coalesce(key, produce) for _ in range(8)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [r.text for r in results] == ["answer"] * 8
+    assert results[0].source == "http" and results[0].eval_count == 5
+    assert all(r.source == "coalesced" and r.eval_count == 0 for r in results[1:])
+    assert cache.coalesced == 7
+    hit = cache.get(cache.key("m", "same prompt"))
+    assert hit.text == "answer" and hit.source == "cache"
+
+
+def test_generation_is_cancelled_only_when_every_caller_left():
+    cache = GenerationCache()
+    finished = []
+
+    async def produce():
+        await asyncio.sleep(0.1)
+        finished.append(1)
+        return Generation(text="late")
+
+    async def main():
+        key = cache.key("m", "p")
+        first = asyncio.create_task(cache.coalesce(key, produce))
+        second = asyncio.create_task(cache.coalesce(key, produce))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert (await second).text == "late"
+
+        key = cache.key("m", "q")
+        tasks = [asyncio.create_task(cache.coalesce(key, produce)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0.15)
+        return key
+
+    key = asyncio.run(main())
+    assert len(finished) == 1
+    assert cache.get(key) is None and not cache.inflight
+
+
+def test_failed_generations_are_not_cached():
+    cache = GenerationCache()
+    key = cache.key("m", "p")
+    cache.put(key, Generation(text="The local model timed out.", ok=False))
+    assert cache.get(key) is None
+
+
+def test_database_io_stays_off_the_event_loop(tmp_path, monkeypatch):
+    path = tmp_path / "gen.sqlite"
+    cache = GenerationCache(path=str(path))
+    threads = []
+    for name in ("_load", "_write"):
+        original = getattr(cache, name)
+        monkeypatch.setattr(cache, name, lambda *a, _f=original: threads.append(threading.current_thread()) or _f(*a))
+
+    async def produce():
+        return Generation(text="answer")
+
+    async def main():
+        key = cache.key("m", "p")
+        assert await cache.aget(key) is None  # miss: looked up in the database
+        await cache.coalesce(key, produce)
+        assert (await cache.aget(key)).text == "answer"  # from memory, before the write lands
+        for _ in range(100):
+            if _db_rows(path)[0]:
+                break
+            await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert _db_rows(path)[0] == 1
+    assert len(threads) == 2 and threading.main_thread() not in threads
+    again = GenerationCache(path=str(path))
+    assert asyncio.run(again.aget(again.key("m", "p"))).text == "answer"
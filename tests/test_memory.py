@@ -0,0 +1,122 @@
+# test_memory.py
+import asyncio
+
+from memory import ConversationMemory, estimate_tokens, parse_budgets
+
+
+def _memory(tmp_path, summarize=None, **kwargs):
+    return ConversationMemory(str(tmp_path / "memory.sqlite"), summarize, **kwargs)
+
+
+def _exchange(i, size=200):
+    return [("user", "question %d %s" % (i, "q" * size)), ("assistant", "answer %d %s" % (i, "a" * size))]
+
+
+def _rows(memory, session):
+    return memory._db.execute("SELECT COUNT(*) FROM turns WHERE session = ?", (session,)).fetchone()[0]
+
+
+def test_recall_stays_within_budget_newest_first(tmp_path):
+    memory = _memory(tmp_path, budget=300)
+    for i in range(10):
+        memory.append("s", _exchange(i))
+    summary, turns = memory.recall("s", reserve=20)
+    assert summary == ""
+    assert sum(estimate_tokens(text) for _, text in turns) <= 280
+    assert turns[-1][1].startswith("answer 9") and turns[0][0] in ("user", "assistant")
+
+
+def test_compact_folds_old_turns_into_a_summary(tmp_path):
+    prompts = []
+
+    async def summarize(text, model, max_tokens):
+        prompts.append((text, max_tokens))
+        return "they asked questions 0 to 7"
+
+    memory = _memory(tmp_path, summarize, budget=400)
+    for i in range(10):
+        assert memory.append("s", _exchange(i)) == (i >= 3)
+    asyncio.run(memory.compact("s"))
+
+    assert len(prompts) == 1 and prompts[0][1] == 100
+    assert "question 0" in prompts[0][0] and "question 9" not in prompts[0][0]
+    summary, turns = memory.recall("s")
+    assert summary == "they asked questions 0 to 7"
+    assert turns[-1][1].startswith("answer 9")
+    assert _rows(memory, "s") < 20 and memory.compactions == 1
+    stored = memory.stats()["stored_tokens"]
+    assert stored <= 400
+    # Later turns continue after the folded ones.
+    memory.append("s", _exchange(10))
+    assert memory.recall("s")[1][-1][1].startswith("answer 10")
+
+
+def test_compact_falls_back_to_an_extract(tmp_path):
+    async def broken(text, model, max_tokens):
+        raise RuntimeError("model down")
+
+    memory = _memory(tmp_path, broken, budget=400)
+    for i in range(10):
+        memory.append("s", _exchange(i))
+    asyncio.run(memory.compact("s"))
+    summary, _ = memory.recall("s")
+    assert "user: question 0" in summary and memory.compactions == 1
+
+
+def test_oversized_tool_output_is_clipped_then_summarised(tmp_path):
+    async def summarize(text, model, max_tokens):
+        return "short tool summary"
+
+    memory = _memory(tmp_path, summarize, budget=2000, tool_tokens=50)
+    memory.append("s", [("user", "read it"), ("tool", "read_file returned:\n" + "z" * 4000), ("assistant", "done")])
+    _, turns = memory.recall("s")
+    assert estimate_tokens(turns[1][1]) <= 50 and "(clipped)" in turns[1][1]
+    asyncio.run(memory.compact("s"))
+    assert memory.recall("s")[1][1] == ("tool", "short tool summary")
+
+
+def test_remember_compacts_only_when_asked(tmp_path):
+    calls = []
+
+    async def summarize(text, model, max_tokens):
+        calls.append(text)
+        return "summary"
+
+    memory = _memory(tmp_path, summarize, budget=300)
+
+    async def main(compact):
+        for i in range(6):
+            await memory.remember("s-%s" % compact, _exchange(i), compact=compact)
+        await asyncio.sleep(0.05)
+        while memory._tasks:
+            await asyncio.gather(*memory._tasks.values())
+
+    asyncio.run(main(False))
+    assert calls == []
+    asyncio.run(main(True))
+    assert calls and memory.recall("s-True")[0] == "summary"
+
+
+def test_reading_over_budget_history_schedules_compaction(tmp_path):
+    async def summarize(text, model, max_tokens):
+        return "summary"
+
+    memory = _memory(tmp_path, summarize, budget=300)
+    for i in range(6):
+        memory.append("s", _exchange(i))
+
+    async def main():
+        first = await memory.history("s")
+        await asyncio.gather(*memory._tasks.values())
+        return first, await memory.history("s")
+
+    first, second = asyncio.run(main())
+    assert first[0] == "" and second[0] == "summary"
+
+
+def test_expire_and_budgets(tmp_path):
+    memory = _memory(tmp_path, ttl=-1, budgets=parse_budgets("big=9000, bad, small=10"))
+    assert memory.budget_for("big") == 9000 and memory.budget_for("small") == 10 and memory.budget_for("x") == 2048
+    memory.append("s", _exchange(0))
+    memory.expire()
+    assert memory.recall("s") == ("", []) and memory.stats()["sessions"] == 0
@@ -0,0 +1,44 @@
+# test_metrics.py
+# Prometheus text rendering of histograms and collectors.
+from metrics import Registry
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    h = registry.histogram("t_seconds", "Test latency.", ["mode"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        h.observe(value, mode="json")
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP t_seconds Test latency.", "# TYPE t_seconds histogram"]
+    assert lines[2:] == [
+        't_seconds_bucket{mode="json",le="0.1"} 1',
+        't_seconds_bucket{mode="json",le="1"} 3',
+        't_seconds_bucket{mode="json",le="+Inf"} 4',
+        't_seconds_sum{mode="json"} 6.050000',
+        't_seconds_count{mode="json"} 4',
+    ]
+
+
+def test_label_values_are_escaped_and_series_kept_apart():
+    registry = Registry()
+    h = registry.histogram("t_seconds", "Test latency.", ["tool"], buckets=(1.0,))
+    h.observe(0.5, tool='say "hi"\\')
+    h.observe(0.5, tool="echo")
+    with h.time(tool="echo"):
+        pass
+    text = registry.render()
+    assert 't_seconds_count{tool="echo"} 2' in text
+    assert 't_seconds_count{tool="say \\"hi\\"\\\\"} 1' in text
+
+
+def test_collectors_report_at_scrape_time():
+    registry = Registry()
+    state = {"active": 1}
+    registry.collect("t_active", "Running now.", "gauge", lambda: [("t_active", {"model": "m"}, state["active"])])
+    assert 't_active{model="m"} 1' in registry.render()
+    state["active"] = 3
+    text = registry.render()
+    assert "# TYPE t_active gauge" in text and 't_active{model="m"} 3' in text
+    # Registering the same name again replaces the collector.
+    registry.collect("t_active", "Running now.", "gauge", lambda: [])
+    assert registry.render().count("# TYPE t_active") == 1
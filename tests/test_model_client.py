@@ -0,0 +1,162 @@
+# test_model_client.py
+# ModelClient / AsyncModelClient against bench.StubModelServer.
+import asyncio, json, os, socket, time
+
+from bench import StubModelServer, fake_ollama_on_path
+from model_client import AsyncModelClient, ModelClient
+
+
+def _closed_port_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return "http://127.0.0.1:%d" % s.getsockname()[1]
+
+
+class FailingStub(StubModelServer):
+    """Replies with an HTTP error, or drops the connection mid-stream."""
+
+    def __init__(self, mode, **kwargs):
+        super().__init__(**kwargs)
+        self.mode = mode
+
+    def handle(self, h, req):
+        if self.mode == "status":
+            data = json.dumps({"error": "model not found"}).encode()
+            h.send_response(404)
+            h.send_header("Content-Length", str(len(data)))
+            h.end_headers()
+            h.wfile.write(data)
+            return
+        h.send_response(200)
+        h.send_header("Transfer-Encoding", "chunked")
+        h.end_headers()
+        line = json.dumps({"response": "partial", "done": False}).encode() + b"\n"
+        h.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        if self.mode == "garbled":
+            h.wfile.write(b"6\r\n{oops\n\r\n0\r\n\r\n")
+        else:
+            h.wfile.write(b"40\r\n{\"response\"")  # short chunk, then hang up
+        h.wfile.flush()
+        h.close_connection = True
+
+
+def test_generate_over_http():
+    with StubModelServer(tokens=3) as stub:
+        client = ModelClient(base_url=stub.base_url, fallback=False)
+        result = client.generate("hello world!")
+    assert result.ok and result.source == "http"
+    assert result.text == "tok0 tok1 tok2 "
+    assert result.prompt_eval_count == 3 and result.eval_count == 3
+    assert result.context
+
+
+def test_stream_yields_tokens_then_final_chunk():
+    with StubModelServer(tokens=3) as stub:
+        chunks = list(ModelClient(base_url=stub.base_url, fallback=False).stream("hi"))
+    assert [c.text for c in chunks] == ["tok0 ", "tok1 ", "tok2 ", ""]
+    assert not any(c.done for c in chunks[:-1]) and chunks[-1].done and chunks[-1].context
+
+
+class PeerStub(StubModelServer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.peers = set()
+
+    def handle(self, h, req):
+        self.peers.add(h.client_address)
+        super().handle(h, req)
+
+
+def test_keep_alive_reuses_one_connection():
+    with PeerStub(tokens=1) as stub:
+        client = ModelClient(base_url=stub.base_url, fallback=False)
+        for _ in range(5):
+            client.generate("x")
+            list(client.stream("x"))
+    assert len(stub.peers) == 1
+
+
+def test_cli_fallback_when_runtime_is_unreachable(monkeypatch):
+    monkeypatch.setenv("PATH", os.environ["PATH"])  # restored after the fake CLI is prepended
+    fake_ollama_on_path(latency=0, tokens=2)
+    client = ModelClient(base_url=_closed_port_url())
+    result = client.generate("hi")
+    assert result.ok and result.source == "cli"
+    assert result.text.strip() == "tok0 tok1"
+    assert [c.source for c in client.stream("hi")] == ["cli"]
+
+
+def test_no_fallback_raises_connection_error():
+    client = ModelClient(base_url=_closed_port_url(), fallback=False)
+    try:
+        client.generate("hi")
+    except Exception as exc:
+        assert "Connection" in type(exc).__name__
+    else:
+        raise AssertionError("expected a connection error")
+
+
+def test_http_error_status_is_a_failed_generation():
+    with FailingStub("status") as stub:
+        client = ModelClient(base_url=stub.base_url, fallback=False)
+        result = client.generate("hi")
+        chunks = list(client.stream("hi"))
+    assert not result.ok and "404" in result.text and "model not found" in result.text
+    assert len(chunks) == 1 and not chunks[0].ok
+
+
+def test_dropped_or_garbled_stream_is_a_failed_generation():
+    for mode in ("drop", "garbled"):
+        with FailingStub(mode) as stub:
+            client = ModelClient(base_url=stub.base_url, fallback=False)
+            chunks = list(client.stream("hi"))
+            result = asyncio.run(AsyncModelClient(client).generate("hi"))
+        assert chunks[0].ok and chunks[0].text == "partial"
+        assert not chunks[-1].ok and chunks[-1].text.startswith("The local model failed")
+        assert not result.ok and result.text.startswith("The local model failed")
+
+
+class RecordingStub(StubModelServer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.finished = None
+
+    def handle(self, h, req):
+        super().handle(h, req)
+        self.finished = time.monotonic()
+
+
+def test_cancelling_async_generate_aborts_upstream():
+    with RecordingStub(tokens=200, token_rate=50) as stub:  # 4 s if left running
+        client = AsyncModelClient(ModelClient(base_url=stub.base_url, fallback=False))
+
+        async def main():
+            task = asyncio.create_task(client.generate("hi"))
+            await asyncio.sleep(0.3)
+            task.cancel()
+            cancelled = time.monotonic()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            for _ in range(100):
+                if stub.finished:
+                    break
+                await asyncio.sleep(0.02)
+            return cancelled
+
+        cancelled = asyncio.run(main())
+    assert stub.finished is not None and stub.finished - cancelled < 1.0
+
+
+def test_async_stream_matches_sync_stream():
+    with StubModelServer(tokens=4) as stub:
+        client = AsyncModelClient(ModelClient(base_url=stub.base_url, fallback=False))
+
+        async def main():
+            return [c async for c in client.stream("hi")]
+
+        chunks = asyncio.run(main())
+        result = asyncio.run(client.generate("hi"))
+    assert "".join(c.text for c in chunks) == result.text == "tok0 tok1 tok2 tok3 "
+    assert result.ok and result.done and result.context
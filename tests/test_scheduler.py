@@ -0,0 +1,90 @@
+# test_scheduler.py
+import asyncio
+
+import pytest
+
+from scheduler import ModelQueue, QueueFull, QueueTimeout, Scheduler
+
+
+def test_waiters_are_served_in_fifo_order():
+    async def main():
+        q = ModelQueue("m", max_concurrent=1, max_queue=8)
+        await q.acquire(None)
+        order = []
+
+        async def waiter(i):
+            await q.acquire(None)
+            order.append(i)
+            await asyncio.sleep(0.01)
+            q.release()
+
+        tasks = [asyncio.create_task(waiter(i)) for i in range(5)]
+        await asyncio.sleep(0.01)
+        assert q.stats()["queued"] == 5
+        q.release()
+        await asyncio.gather(*tasks)
+        return order, q
+
+    order, q = asyncio.run(main())
+    assert order == [0, 1, 2, 3, 4]
+    assert q.active == 0 and not q.waiters
+
+
+def test_full_queue_is_rejected_with_429():
+    async def main():
+        q = ModelQueue("m", max_concurrent=1, max_queue=1)
+        await q.acquire(None)
+        waiting = asyncio.create_task(q.acquire(None))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFull) as exc:
+            await q.acquire(None)
+        q.release()
+        await waiting
+        q.release()
+        return exc.value
+
+    exc = asyncio.run(main())
+    assert exc.status_code == 429 and exc.retry_after >= 1
+
+
+def test_queue_wait_past_timeout_is_503():
+    async def main():
+        scheduler = Scheduler(max_concurrent=1, max_queue=4, queue_timeout=0.05)
+        async with scheduler.slot("m"):
+            with pytest.raises(QueueTimeout) as exc:
+                async with scheduler.slot("m"):
+                    pass
+        return exc.value, scheduler.queue("m")
+
+    exc, q = asyncio.run(main())
+    assert exc.status_code == 503 and exc.retry_after >= 1
+    assert q.timed_out == 1 and q.active == 0 and not q.waiters
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def main():
+        q = ModelQueue("m", max_concurrent=1, max_queue=4)
+        await q.acquire(None)
+        waiting = asyncio.create_task(q.acquire(None))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        q.release()
+        return q
+
+    q = asyncio.run(main())
+    assert q.active == 0 and not q.waiters
+
+
+def test_unused_reservation_is_released_once():
+    async def main():
+        scheduler = Scheduler(max_concurrent=1)
+        reserved = await scheduler.reserve("m")
+        reserved.release()
+        reserved.release()
+        async with scheduler.slot("m", scheduler.deadline()):
+            pass
+        return scheduler.queue("m")
+
+    q = asyncio.run(main())
+    assert q.active == 0 and q.admitted == 2